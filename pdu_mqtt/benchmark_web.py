@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Web interface benchmark
+Simulates concurrent dashboard clients and reports requests per second and latency
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# What an open dashboard requests: the page itself plus its periodic polling
+DEFAULT_PATHS = ['/', '/api/ha_theme', '/api/scan/status', '/api/load_config']
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))
+    return values[index]
+
+def run_client(base_url, paths, deadline, latencies, errors, lock):
+    """One dashboard client: keep-alive session issuing requests until the deadline"""
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        for path in paths:
+            started = time.perf_counter()
+            try:
+                response = session.get(base_url + path, timeout=10)
+                ok = response.status_code < 500
+            except requests.exceptions.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.setdefault(path, []).append(elapsed)
+                else:
+                    errors[path] = errors.get(path, 0) + 1
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the device discovery web interface')
+    parser.add_argument('--url', default='http://localhost:8099', help='Base URL of the web interface')
+    parser.add_argument('--clients', type=int, default=20, help='Number of concurrent dashboard clients')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to run')
+    parser.add_argument('--path', action='append', dest='paths', help='Path to request (repeatable)')
+    args = parser.parse_args()
+
+    paths = args.paths or DEFAULT_PATHS
+    latencies, errors, lock = {}, {}, threading.Lock()
+
+    print(f"Benchmarking {args.url} with {args.clients} clients for {args.duration}s")
+    started = time.monotonic()
+    deadline = started + args.duration
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        for _ in range(args.clients):
+            executor.submit(run_client, args.url.rstrip('/'), paths, deadline, latencies, errors, lock)
+    elapsed = time.monotonic() - started
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n{'path':<24}{'requests':>10}{'errors':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for path in paths:
+        values = sorted(latencies.get(path, []))
+        mean = statistics.mean(values) if values else 0.0
+        print(f"{path:<24}{len(values):>10}{errors.get(path, 0):>8}{mean * 1000:>10.1f}"
+              f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}")
+    print(f"\nTotal: {total} requests, {sum(errors.values())} errors, {total / elapsed:.1f} req/s")
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ import json
 from typing import Optional, Dict, Any
 import requests
 from xml.etree import ElementTree as ET
+from pdu import count_outlets, DEFAULT_OUTLET_COUNT
 
 logger = logging.getLogger(__name__)
 
@@ -42,7 +43,7 @@ class PDUBugFixes:
             }
             
             # Extract outlet status with fallback
-            for i in range(8):
+            for i in range(count_outlets(xml_content) or DEFAULT_OUTLET_COUNT):
                 tag = f"outletStat{i}"
                 val = xml.findtext(tag)
                 if val is not None:
@@ -111,11 +112,11 @@ class PDUBugFixes:
         return None
     
     @staticmethod
-    def fix_outlet_state_validation(outlet_num: int, state: Any) -> bool:
+    def fix_outlet_state_validation(outlet_num: int, state: Any, outlet_count: int = DEFAULT_OUTLET_COUNT) -> bool:
         """
         Bug Fix: Robust outlet state validation
         """
-        if not isinstance(outlet_num, int) or outlet_num < 1 or outlet_num > 8:
+        if not isinstance(outlet_num, int) or outlet_num < 1 or outlet_num > outlet_count:
             logger.error(f"Invalid outlet number: {outlet_num}")
             return False
         
@@ -218,6 +219,8 @@ class PDUBugFixes:
                 'username': str(pdu.get('username', 'admin')).strip(),
                 'password': str(pdu.get('password', 'admin'))
             }
+            if pdu.get('outlets'):
+                fixed_pdu['outlets'] = int(pdu['outlets'])
             
             # Validação básica de IP/hostname
             if not fixed_pdu['host'] or '/' in fixed_pdu['host']:
@@ -8,50 +8,296 @@ import requests
 import json
 import re
 import logging
+import subprocess
+import socket
+import errno
+import threading
+import warnings
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+from urllib3.exceptions import InsecureRequestWarning
 from xml.etree import ElementTree as ET
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from pdu import count_outlets
 
 logger = logging.getLogger(__name__)
 
+# HTTPS probes target embedded devices with self-signed certificates
+warnings.filterwarnings('ignore', category=InsecureRequestWarning)
+
+TITLE_RE = re.compile(r'<title>(.*?)</title>', re.IGNORECASE)
+
+# Enough for a <title>, a status.xml <response> or a Shelly JSON document
+DEFAULT_PROBE_MAX_BYTES = 64 * 1024
+
+# Connect errors that mean no port of the host can answer
+UNREACHABLE_ERRNOS = (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN)
+
+class ProbeResponse:
+    """Body prefix and status of a bounded discovery probe"""
+    
+    def __init__(self, status_code, content, encoding=None, truncated=False):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding or 'utf-8'
+        self.truncated = truncated
+    
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+    
+    def json(self):
+        return json.loads(self.text)
+
+class ProbeCancelled(requests.exceptions.RequestException):
+    """Raised by probes of a scan that has been cancelled"""
+
+def bounded_get(url, max_bytes=DEFAULT_PROBE_MAX_BYTES, timeout=3, cancel_event=None, **kwargs):
+    """GET a URL reading at most max_bytes of the body, then close the connection"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise ProbeCancelled(url)
+    
+    with requests.get(url, timeout=timeout, stream=True, **kwargs) as response:
+        content = bytearray()
+        truncated = False
+        for chunk in response.iter_content(chunk_size=min(max_bytes, 8192)):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ProbeCancelled(url)
+            content.extend(chunk)
+            if len(content) >= max_bytes:
+                truncated = True
+                break
+        # Leaving the context closes the socket instead of draining the rest
+        return ProbeResponse(response.status_code, bytes(content[:max_bytes]),
+                             response.encoding, truncated)
+
+def read_neighbour_table(arp_path='/proc/net/arp'):
+    """Return {ip: mac} for hosts in the kernel ARP/neighbour table"""
+    neighbours = {}
+    
+    try:
+        with open(arp_path, 'r') as f:
+            next(f, None)  # Header line
+            for line in f:
+                fields = line.split()
+                # IP address, HW type, Flags, HW address, Mask, Device
+                if len(fields) >= 4 and fields[2] != '0x0' and fields[3] != '00:00:00:00:00:00':
+                    neighbours[fields[0]] = fields[3].lower()
+    except Exception as e:
+        logger.debug(f"Could not read {arp_path}: {e}")
+    
+    # The neighbour table also lists STALE entries that /proc/net/arp may not show
+    try:
+        output = subprocess.run(['ip', '-4', 'neigh', 'show'], capture_output=True,
+                                text=True, timeout=1).stdout
+        for line in output.splitlines():
+            fields = line.split()
+            if 'lladdr' in fields and fields[-1] not in ('FAILED', 'INCOMPLETE'):
+                neighbours.setdefault(fields[0], fields[fields.index('lladdr') + 1].lower())
+    except Exception as e:
+        logger.debug(f"Could not read neighbour table: {e}")
+    
+    return neighbours
+
 class DeviceDetector:
-    def __init__(self):
+    def __init__(self, max_probe_bytes=DEFAULT_PROBE_MAX_BYTES):
+        self.max_probe_bytes = max_probe_bytes
+        # Set by the running scan; once set every further probe fails immediately
+        self.cancel_event = None
+        # Optional ProbeRateLimiter shared by every probe of a scan
+        self.rate_limiter = None
         self.device_patterns = {
             'shelly': {
                 'endpoints': ['/status', '/settings', '/shelly'],
                 'keywords': ['shelly', 'allterco', 'generation'],
                 'headers': {'User-Agent': 'Mozilla/5.0'},
-                'ports': [80]
+                'ports': [80],
+                'https_ports': [],
+                # Espressif OUIs used by Shelly hardware
+                'oui_prefixes': ['08:3a:f2', '24:0a:c4', '24:6f:28', '30:ae:a4', '34:94:54', '3c:71:bf',
+                                 '48:3f:da', '84:cc:a8', '8c:aa:b5', '98:cd:ac', 'a4:cf:12', 'c4:4f:33',
+                                 'e8:db:84', 'ec:fa:bc']
             },
             'pdu_logilink': {
                 'endpoints': ['/status.xml'],
                 'keywords': ['<response>', '<outlet', '<status>'],
                 'headers': {},
-                'ports': [80]
+                'ports': [80],
+                'https_ports': [],
+                'oui_prefixes': []
             },
             'pdu_generic': {
                 'endpoints': ['/', '/index.html', '/status', '/api/status', '/cgi-bin/status.cgi'],
                 'keywords': ['pdu', 'outlet', 'power distribution', 'logilink', 'intellinet', 'switched outlet'],
                 'headers': {},
-                'ports': [80, 8080]
+                'ports': [80, 8080],
+                'https_ports': [443],
+                'oui_prefixes': []
             },
             'false_positive_filters': {
                 'keywords': ['iptv', 'tv box', 'android tv', 'kodi', 'plex', 'router', 'access point', 'switch'],
+                'patterns': [r'tv.*box', r'android.*tv', r'media.*player', r'access.*point'],
                 'titles': ['iptv', 'tv', 'media', 'router', 'access point', 'switch', 'modem']
             }
         }
+        self.classifier = self._compile_classifier()
+        self.oui_vendors = {
+            prefix: name
+            for name, pattern in self.device_patterns.items()
+            for prefix in pattern.get('oui_prefixes', [])
+        }
+        # Every port any pattern may probe, plain HTTP on 80 first
+        self.probe_ports = sorted(
+            {port for pattern in self.device_patterns.values()
+             for port in pattern.get('ports', []) + pattern.get('https_ports', [])},
+            key=lambda port: (port != 80, port)
+        )
     
-    def detect_shelly_device(self, ip, timeout=3):
+    def _compile_classifier(self):
+        """Compile all keyword rules into (regex, groups, sequences)
+        
+        regex is one plain alternation over every lowercase keyword, longest
+        first; groups maps each keyword to the rule groups of every keyword
+        it contains, so a match on '<outlet' also counts as 'outlet'. The
+        'a.*b' false positive patterns become literal sequences checked on
+        top, since a '.*' inside the alternation would run from every
+        candidate position.
+        """
+        filters = self.device_patterns['false_positive_filters']
+        keywords = {}
+        for keyword in filters['keywords']:
+            keywords.setdefault(keyword.lower(), set()).add('false_positive')
+        for name, pattern in self.device_patterns.items():
+            if name != 'false_positive_filters':
+                for keyword in pattern['keywords']:
+                    keywords.setdefault(keyword.lower(), set()).add(name)
+        
+        groups = {
+            keyword: frozenset().union(*(names for other, names in keywords.items() if other in keyword))
+            for keyword in keywords
+        }
+        alternation = '|'.join(re.escape(keyword) for keyword in sorted(groups, key=len, reverse=True))
+        sequences = [tuple(part.lower() for part in pattern.split('.*')) for pattern in filters['patterns']]
+        return re.compile(alternation), groups, sequences
+    
+    @staticmethod
+    def _has_sequence(content, parts):
+        """True if the parts appear in order on one line, like the regex 'a.*b'
+        
+        Only the first occurrence of parts[0] on a line can matter, so each
+        line is searched once and the check stays linear.
+        """
+        first, rest = parts[0], parts[1:]
+        pos = content.find(first)
+        while pos != -1:
+            line_end = content.find('\n', pos)
+            if line_end == -1:
+                line_end = len(content)
+            cursor = pos + len(first)
+            for part in rest:
+                found = content.find(part, cursor, line_end)
+                if found == -1:
+                    break
+                cursor = found + len(part)
+            else:
+                return True
+            pos = content.find(first, line_end)
+        return False
+    
+    def classify(self, content):
+        """Return the names of all rule groups matching the content
+        
+        The body is lowercased once and scanned once by the keyword
+        alternation. A false positive overrides every other rule; the
+        sequence patterns are only checked if no keyword already found one.
+        """
+        regex, groups, sequences = self.classifier
+        content = content.lower()
+        matched = set()
+        # findall keeps the per-match work in C; repeated keywords are folded by the set
+        for keyword in set(regex.findall(content)):
+            matched |= groups[keyword]
+        if 'false_positive' in matched:
+            return matched
+        if any(self._has_sequence(content, parts) for parts in sequences):
+            matched.add('false_positive')
+        return matched
+    
+    def vendor_hint(self, mac):
+        """Return the device pattern whose OUI matches a MAC address, if any"""
+        return self.oui_vendors.get((mac or '')[:8].lower())
+    
+    def _limited(self, host):
+        """Rate limiter context for one probe of host"""
+        if self.rate_limiter is None:
+            return nullcontext(True)
+        return self.rate_limiter.probe(host, self.cancel_event)
+    
+    def _get(self, url, timeout=3, **kwargs):
+        """Run a discovery probe bounded by the byte budget and rate limits"""
+        if url.startswith('https://'):
+            kwargs.setdefault('verify', False)
+        
+        with self._limited(urlsplit(url).hostname) as allowed:
+            if not allowed:
+                raise ProbeCancelled(url)
+            return bounded_get(url, self.max_probe_bytes, timeout=timeout,
+                               cancel_event=self.cancel_event, **kwargs)
+    
+    def reachable_ports(self, ip, ports=None, timeout=3):
+        """Return the ports of ip that accept TCP connections
+        
+        A refused or timed out connection only rules out that port (firewalls
+        often drop single ports), but an unreachable host or network ends the
+        check so dead hosts cost a single connect.
+        """
+        open_ports = set()
+        for port in ports or self.probe_ports:
+            with self._limited(ip) as allowed:
+                if not allowed:
+                    break
+                try:
+                    socket.create_connection((ip, port), timeout=timeout).close()
+                    open_ports.add(port)
+                except OSError as e:
+                    if e.errno in UNREACHABLE_ERRNOS:
+                        break
+        return open_ports
+    
+    def base_urls(self, ip, pattern_name, open_ports=None):
+        """Return (base_url, port) for each port a pattern declares, skipping closed ones"""
+        pattern = self.device_patterns[pattern_name]
+        urls = []
+        for scheme, default_port, ports in (('http', 80, pattern['ports']),
+                                            ('https', 443, pattern.get('https_ports', []))):
+            for port in ports:
+                if open_ports is None or port in open_ports:
+                    suffix = '' if port == default_port else f":{port}"
+                    urls.append((f"{scheme}://{ip}{suffix}", port))
+        return urls
+    
+    def detect_shelly_device(self, ip, timeout=3, open_ports=None):
         """Detect Shelly devices and get their capabilities"""
+        for base_url, port in self.base_urls(ip, 'shelly', open_ports):
+            result = self._detect_shelly_at(ip, base_url, timeout)
+            if result:
+                result['port'] = port
+                return result
+        return None
+    
+    def _detect_shelly_at(self, ip, base_url, timeout):
+        """Test the Shelly Gen 1 and Gen 2 APIs at one base URL"""
         try:
             # Test Shelly Gen 1 API
-            response = requests.get(f"http://{ip}/status", timeout=timeout)
+            response = self._get(f"{base_url}/status", timeout=timeout)
             if response.status_code == 200:
                 try:
                     data = response.json()
                     if 'mac' in data and ('relays' in data or 'switches' in data or 'lights' in data):
-                        device_info = self.get_shelly_info(ip, data)
+                        device_info = self.get_shelly_info(ip, data, base_url)
                         return {
                             'ip': ip,
+                            'mac': data.get('mac'),
                             'type': 'Shelly',
                             'model': device_info.get('model', 'Unknown'),
                             'generation': device_info.get('generation', 1),
@@ -66,14 +312,15 @@ class DeviceDetector:
                     pass
             
             # Test Shelly Gen 2 API
-            response = requests.get(f"http://{ip}/rpc/Shelly.GetDeviceInfo", timeout=timeout)
+            response = self._get(f"{base_url}/rpc/Shelly.GetDeviceInfo", timeout=timeout)
             if response.status_code == 200:
                 try:
                     data = response.json()
                     if 'result' in data and 'id' in data['result']:
-                        device_info = self.get_shelly_gen2_info(ip, data['result'])
+                        device_info = self.get_shelly_gen2_info(ip, data['result'], base_url)
                         return {
                             'ip': ip,
+                            'mac': data['result'].get('mac'),
                             'type': 'Shelly Gen2',
                             'model': device_info.get('model', 'Unknown'),
                             'generation': 2,
@@ -91,8 +338,9 @@ class DeviceDetector:
             pass
         return None
     
-    def get_shelly_info(self, ip, status_data):
+    def get_shelly_info(self, ip, status_data, base_url=None):
         """Extract Shelly device information from Gen 1 API"""
+        base_url = base_url or f"http://{ip}"
         info = {
             'model': 'Shelly',
             'generation': 1,
@@ -102,7 +350,7 @@ class DeviceDetector:
         
         # Get device info
         try:
-            settings_response = requests.get(f"http://{ip}/settings", timeout=2)
+            settings_response = self._get(f"{base_url}/settings", timeout=2)
             if settings_response.status_code == 200:
                 settings = settings_response.json()
                 info['model'] = settings.get('device', {}).get('type', 'Shelly')
@@ -125,8 +373,9 @@ class DeviceDetector:
         
         return info
     
-    def get_shelly_gen2_info(self, ip, device_info):
+    def get_shelly_gen2_info(self, ip, device_info, base_url=None):
         """Extract Shelly device information from Gen 2 API"""
+        base_url = base_url or f"http://{ip}"
         info = {
             'model': device_info.get('model', 'Shelly Gen2'),
             'generation': 2,
@@ -136,7 +385,7 @@ class DeviceDetector:
         
         # Get switch status to count channels
         try:
-            status_response = requests.get(f"http://{ip}/rpc/Shelly.GetStatus", timeout=2)
+            status_response = self._get(f"{base_url}/rpc/Shelly.GetStatus", timeout=2)
             if status_response.status_code == 200:
                 status = status_response.json()
                 if 'result' in status:
@@ -160,47 +409,50 @@ class DeviceDetector:
         
         return info
     
-    def detect_pdu_device(self, ip, timeout=3):
+    def detect_pdu_device(self, ip, timeout=3, open_ports=None):
         """Detect PDU devices"""
-        try:
-            # Test LogiLink/Intellinet specific endpoint
-            response = requests.get(f"http://{ip}/status.xml", timeout=timeout)
-            if response.status_code == 200 and "<response>" in response.text:
-                outlet_count = response.text.count("<outlet")
-                return {
-                    'ip': ip,
-                    'type': 'PDU',
-                    'model': 'LogiLink/Intellinet',
-                    'outlets': outlet_count,
-                    'auth_required': False,
-                    'endpoints': ['/status.xml', '/outlet.xml'],
-                    'compatible': True
-                }
-            elif response.status_code == 401:
-                return {
-                    'ip': ip,
-                    'type': 'PDU',
-                    'model': 'LogiLink/Intellinet',
-                    'outlets': 'Unknown',
-                    'auth_required': True,
-                    'endpoints': ['/status.xml', '/outlet.xml'],
-                    'compatible': True
-                }
-        except:
-            pass
+        # Test LogiLink/Intellinet specific endpoint
+        for base_url, port in self.base_urls(ip, 'pdu_logilink', open_ports):
+            try:
+                response = self._get(f"{base_url}/status.xml", timeout=timeout)
+                if response.status_code == 200 and "<response>" in response.text:
+                    outlet_count = count_outlets(response.text)
+                    return {
+                        'ip': ip,
+                        'port': port,
+                        'type': 'PDU',
+                        'model': 'LogiLink/Intellinet',
+                        'outlets': outlet_count,
+                        'auth_required': False,
+                        'endpoints': ['/status.xml', '/outlet.xml'],
+                        'compatible': True
+                    }
+                elif response.status_code == 401:
+                    return {
+                        'ip': ip,
+                        'port': port,
+                        'type': 'PDU',
+                        'model': 'LogiLink/Intellinet',
+                        'outlets': 'Unknown',
+                        'auth_required': True,
+                        'endpoints': ['/status.xml', '/outlet.xml'],
+                        'compatible': True
+                    }
+            except:
+                pass
         
         # Test generic PDU endpoints
-        endpoints = ["/", "/index.html", "/status", "/api/status", "/cgi-bin/status.cgi"]
-        for endpoint in endpoints:
-            try:
-                response = requests.get(f"http://{ip}{endpoint}", timeout=timeout)
-                if response.status_code == 200:
-                    content = response.text.lower()
-                    if any(keyword in content for keyword in ["pdu", "outlet", "power distribution", "switched outlet"]):
-                        # Check if it's not a false positive
-                        if not self.is_false_positive(content):
+        endpoints = self.device_patterns['pdu_generic']['endpoints']
+        for base_url, port in self.base_urls(ip, 'pdu_generic', open_ports):
+            for endpoint in endpoints:
+                try:
+                    response = self._get(f"{base_url}{endpoint}", timeout=timeout)
+                    if response.status_code == 200:
+                        matched = self.classify(response.text)
+                        if 'pdu_generic' in matched and 'false_positive' not in matched:
                             return {
                                 'ip': ip,
+                                'port': port,
                                 'type': 'PDU',
                                 'model': 'Generic PDU',
                                 'outlets': 'Unknown',
@@ -208,49 +460,50 @@ class DeviceDetector:
                                 'endpoints': [endpoint],
                                 'compatible': False
                             }
-            except:
-                continue
+                except:
+                    continue
         
         return None
     
     def is_false_positive(self, content):
         """Check if the detected device is a false positive"""
-        false_positive_keywords = self.device_patterns['false_positive_filters']['keywords']
-        
-        for keyword in false_positive_keywords:
-            if keyword in content.lower():
-                return True
-        
-        # Check for common false positive patterns
-        if re.search(r'iptv|tv.*box|android.*tv|media.*player|router|access.*point', content.lower()):
-            return True
-        
-        return False
+        return 'false_positive' in self.classify(content)
     
     def detect_device(self, ip, timeout=3):
         """Detect any supported device at the given IP"""
+        # One TCP check per port decides which HTTP probes are worth sending
+        open_ports = self.reachable_ports(ip, timeout=timeout)
+        if not open_ports:
+            return None
+        
         # First try Shelly detection
-        shelly_result = self.detect_shelly_device(ip, timeout)
+        shelly_result = self.detect_shelly_device(ip, timeout, open_ports)
         if shelly_result:
             return shelly_result
         
         # Then try PDU detection
-        pdu_result = self.detect_pdu_device(ip, timeout)
+        pdu_result = self.detect_pdu_device(ip, timeout, open_ports)
         if pdu_result:
             return pdu_result
         
         # Check for basic web interface (potential unknown device)
+        http_port = next((port for port in (80, 8080) if port in open_ports), None)
+        if http_port is None:
+            return None
+        
         try:
-            response = requests.get(f"http://{ip}/", timeout=timeout)
+            base_url = f"http://{ip}" if http_port == 80 else f"http://{ip}:{http_port}"
+            response = self._get(f"{base_url}/", timeout=timeout)
             if response.status_code == 200:
-                content = response.text.lower()
+                content = response.text
                 if not self.is_false_positive(content):
                     # Extract title if available
-                    title_match = re.search(r'<title>(.*?)</title>', content, re.IGNORECASE)
+                    title_match = TITLE_RE.search(content)
                     title = title_match.group(1) if title_match else 'Unknown Device'
                     
                     return {
                         'ip': ip,
+                        'port': http_port,
                         'type': 'Unknown Device',
                         'model': title[:50],  # Truncate long titles
                         'auth_required': False,
@@ -262,53 +515,203 @@ class DeviceDetector:
         
         return None
 
-class DeviceDiscovery:
+class ScanEventStore:
+    """Thread-safe scan state with an append-only event log for streaming clients"""
+    
     def __init__(self):
+        self.condition = threading.Condition()
         self.scanning = False
-        self.discovered_devices = []
-        self.scan_progress = 0
-        self.detector = DeviceDetector()
-    
-    def scan_network(self, network_prefix="192.168.1", start=1, end=254, max_workers=50):
-        """Scan network for supported devices"""
-        self.scanning = True
-        self.discovered_devices = []
-        self.scan_progress = 0
+        self.progress = 0
+        self.devices = []
+        self.events = []
+        self.first_id = 1  # Event ids keep increasing across scans
+    
+    @property
+    def last_id(self):
+        with self.condition:
+            return self.first_id + len(self.events) - 1
+    
+    def _publish(self, event, data):
+        """Append an event and wake up waiting streams (caller holds the lock)"""
+        self.events.append({'id': self.first_id + len(self.events), 'event': event, 'data': data})
+        self.condition.notify_all()
+    
+    def start(self, total, **info):
+        """Reset the state for a new scan"""
+        with self.condition:
+            self.first_id += len(self.events)
+            self.events = []
+            self.scanning = True
+            self.progress = 0
+            self.devices = []
+            self._publish('start', dict(info, total=total))
+    
+    def add_device(self, device):
+        with self.condition:
+            self.devices.append(device)
+            self._publish('device', device)
+    
+    def set_progress(self, processed, total):
+        """Record progress, publishing an event only when the percentage changes"""
+        progress = int((processed / total) * 100) if total else 100
+        with self.condition:
+            if progress != self.progress:
+                self.progress = progress
+                self._publish('progress', {
+                    'progress': progress,
+                    'processed': processed,
+                    'total': total,
+                    'found': len(self.devices)
+                })
+    
+    def finish(self, status='completed'):
+        with self.condition:
+            self.scanning = False
+            if status == 'completed':
+                self.progress = 100
+            self._publish('complete', {'found': len(self.devices), 'status': status})
+    
+    def wait_for_events(self, last_id, timeout=15):
+        """Return events newer than last_id, waiting up to timeout for one"""
+        with self.condition:
+            if self.first_id + len(self.events) - 1 <= last_id:
+                self.condition.wait(timeout)
+            return self.events[max(last_id + 1 - self.first_id, 0):]
+    
+    def snapshot(self):
+        with self.condition:
+            return {
+                'scanning': self.scanning,
+                'progress': self.progress,
+                'discovered_devices': list(self.devices),
+                'last_event_id': self.first_id + len(self.events) - 1
+            }
+
+class DeviceDiscovery:
+    def __init__(self, max_probe_bytes=DEFAULT_PROBE_MAX_BYTES, cache=None, use_neighbours=True,
+                 rate_limiter=None, passive=None):
+        self.results = ScanEventStore()
+        self.detector = DeviceDetector(max_probe_bytes)
+        self.detector.rate_limiter = rate_limiter
+        self.cache = cache
+        self.use_neighbours = use_neighbours
+        # Optional PassiveListener whose mDNS/SSDP inventory replaces active probes
+        self.passive = passive
+    
+    @property
+    def scanning(self):
+        return self.results.scanning
+    
+    @property
+    def scan_progress(self):
+        return self.results.progress
+    
+    @property
+    def discovered_devices(self):
+        return self.results.devices
+    
+    def prioritize(self, ips, neighbours):
+        """Order hosts: known vendor MACs, then live neighbours, then blind probes"""
+        def rank(ip):
+            mac = neighbours.get(ip)
+            if mac and self.detector.vendor_hint(mac):
+                return 0
+            return 1 if mac else 2
+        # sorted() is stable, so the cache's known-devices-first order is kept within each rank
+        return sorted(ips, key=rank)
+    
+    def _probe(self, ip, cancel_event):
+        """Detect a single host unless the scan was cancelled before it started"""
+        if cancel_event.is_set():
+            return None
+        return self.detector.detect_device(ip)
+    
+    def scan_network(self, network_prefix="192.168.1", start=1, end=254, max_workers=50, refresh=False,
+                     results=None, cancel_event=None):
+        """Scan network for supported devices
+        
+        With a cache, fresh results are reused and only expired or unknown
+        hosts are probed; refresh=True forces a full rescan. Progress goes to
+        results (the shared store by default) and setting cancel_event stops
+        all outstanding probes.
+        """
+        results = results or self.results
+        cancel_event = cancel_event or threading.Event()
+        self.detector.cancel_event = cancel_event
         
         logger.info(f"Scanning network {network_prefix}.{start}-{end} for devices...")
         
-        total_ips = end - start + 1
-        processed = 0
+        ips = [f"{network_prefix}.{i}" for i in range(start, end + 1)]
+        total_ips = len(ips)
+        results.start(total_ips, network=network_prefix, start=start, end=end)
+        
+        if self.cache and not refresh:
+            cached, skipped, to_probe = self.cache.plan(ips)
+            for device in cached:
+                results.add_device(device)
+            logger.info(f"Discovery cache: {len(cached)} known devices, {len(skipped)} empty hosts skipped, "
+                        f"{len(to_probe)} hosts to probe")
+        else:
+            cached, skipped, to_probe = [], [], ips
+        
+        if self.passive:
+            announced, ignored, to_probe = self.passive.partition(to_probe)
+            for device in announced:
+                results.add_device(device)
+                if self.cache:
+                    self.cache.store(device['ip'], device)
+            if announced or ignored:
+                logger.info(f"Passive inventory: {len(announced)} announced devices, "
+                            f"{len(ignored)} known non-targets skipped")
+        
+        neighbours = read_neighbour_table() if self.use_neighbours else {}
+        if neighbours:
+            to_probe = self.prioritize(to_probe, neighbours)
+            logger.info(f"Neighbour table seeded {sum(1 for ip in to_probe if ip in neighbours)} likely-live hosts")
+        
+        processed = total_ips - len(to_probe)
+        results.set_progress(processed, total_ips)
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Create futures for all IPs
+            # Create futures in priority order so likely devices are probed first
             future_to_ip = {
-                executor.submit(self.detector.detect_device, f"{network_prefix}.{i}"): f"{network_prefix}.{i}"
-                for i in range(start, end + 1)
+                executor.submit(self._probe, ip, cancel_event): ip
+                for ip in to_probe
             }
             
             # Process completed futures
             for future in as_completed(future_to_ip):
+                if cancel_event.is_set():
+                    for pending in future_to_ip:
+                        pending.cancel()
+                    logger.info(f"Scan of {network_prefix}.{start}-{end} cancelled")
+                    break
+                
                 ip = future_to_ip[future]
                 try:
                     result = future.result()
+                    if result and not result.get('mac') and neighbours.get(ip):
+                        # Most devices don't report their MAC; the neighbour table knows it
+                        result['mac'] = neighbours[ip]
                     if result:
-                        self.discovered_devices.append(result)
+                        results.add_device(result)
                         logger.info(f"Found device: {result['type']} at {ip}")
+                    if self.cache:
+                        self.cache.store(ip, result, neighbours.get(ip))
                 except Exception as e:
                     logger.debug(f"Error checking {ip}: {e}")
                 
                 processed += 1
-                self.scan_progress = int((processed / total_ips) * 100)
+                results.set_progress(processed, total_ips)
         
-        self.scanning = False
-        logger.info(f"Scan complete. Found {len(self.discovered_devices)} devices.")
-        return self.discovered_devices
+        if self.cache:
+            self.cache.save()
+        
+        results.finish('cancelled' if cancel_event.is_set() else 'completed')
+        devices = results.snapshot()['discovered_devices']
+        logger.info(f"Scan complete. Found {len(devices)} devices.")
+        return devices
     
     def get_scan_status(self):
         """Get current scan status"""
-        return {
-            'scanning': self.scanning,
-            'progress': self.scan_progress,
-            'discovered_devices': self.discovered_devices
-        }
\ No newline at end of file
+        return self.results.snapshot()
@@ -10,13 +10,14 @@ import time
 import json
 import sys
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from device_detection import bounded_get, DEFAULT_PROBE_MAX_BYTES, ProbeCancelled
 
-def test_pdu_endpoint(ip, timeout=2):
+def test_pdu_endpoint(ip, timeout=2, max_bytes=DEFAULT_PROBE_MAX_BYTES):
     """Test if an IP has a PDU endpoint"""
     try:
         # Test status.xml endpoint
         url = f"http://{ip}/status.xml"
-        response = requests.get(url, timeout=timeout)
+        response = bounded_get(url, max_bytes, timeout=timeout)
         
         if response.status_code == 200 and "<response>" in response.text:
             return ip, "status.xml", response.text[:200]
@@ -28,7 +29,7 @@ def test_pdu_endpoint(ip, timeout=2):
         for endpoint in endpoints:
             try:
                 url = f"http://{ip}{endpoint}"
-                response = requests.get(url, timeout=timeout)
+                response = bounded_get(url, max_bytes, timeout=timeout)
                 if response.status_code == 200 and any(keyword in response.text.lower() for keyword in ["pdu", "outlet", "power", "logilink", "intellinet"]):
                     return ip, endpoint, response.text[:200]
             except:
@@ -73,22 +74,67 @@ def scan_network(network_prefix="192.168.1", start=1, end=254, max_workers=50):
     
     return found_pdus
 
-def test_pdu_credentials(ip, usernames=["admin", "root", "user"], passwords=["admin", "password", "1234", ""]):
-    """Test common PDU credentials"""
+class AttemptLimiter:
+    """Per-device limit on concurrent and back-to-back login attempts"""
+    
+    def __init__(self, max_in_flight=2, min_interval=0.2):
+        self.semaphore = threading.BoundedSemaphore(max_in_flight)
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+    
+    def __enter__(self):
+        self.semaphore.acquire()
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+def test_pdu_credentials(ip, usernames=["admin", "root", "user"], passwords=["admin", "password", "1234", ""],
+                         max_in_flight=2, min_interval=0.2):
+    """Test common PDU credentials concurrently, stopping at the first valid pair"""
     print(f"🔐 Testing credentials for {ip}...")
     
-    for username in usernames:
-        for password in passwords:
+    url = f"http://{ip}/status.xml"
+    found = threading.Event()
+    limiter = AttemptLimiter(max_in_flight, min_interval)
+    
+    def attempt(username, password):
+        if found.is_set():
+            return None
+        with limiter:
             try:
-                url = f"http://{ip}/status.xml"
-                response = requests.get(url, auth=(username, password), timeout=3)
-                
+                # Remaining attempts are aborted as soon as another one succeeds
+                response = bounded_get(url, auth=(username, password), timeout=3, cancel_event=found)
                 if response.status_code == 200 and "<response>" in response.text:
-                    print(f"✅ Valid credentials found: {username}:{password}")
                     return username, password
-                    
+            except ProbeCancelled:
+                pass
             except:
-                continue
+                pass
+        return None
+    
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        futures = [
+            executor.submit(attempt, username, password)
+            for username in usernames
+            for password in passwords
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if result:
+                found.set()
+                print(f"✅ Valid credentials found for {ip}: {result[0]}:{result[1]}")
+                return result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     
     print(f"❌ No valid credentials found for {ip}")
     return None, None
@@ -116,13 +162,14 @@ def main():
     print(f"\n🎉 Found {len(pdus)} potential PDU(s):")
     print("=" * 50)
     
-    # Test credentials for each found PDU
+    # Test credentials for all found PDUs in parallel
     working_pdus = []
     
-    for pdu in pdus:
-        print(f"\n📡 Testing PDU at {pdu['ip']}...")
-        username, password = test_pdu_credentials(pdu['ip'])
-        
+    print(f"\n📡 Testing {len(pdus)} PDU(s)...")
+    with ThreadPoolExecutor(max_workers=min(len(pdus), 16)) as executor:
+        credentials = list(executor.map(lambda pdu: test_pdu_credentials(pdu['ip']), pdus))
+    
+    for pdu, (username, password) in zip(pdus, credentials):
         if username and password:
             working_pdus.append({
                 "name": f"pdu_{pdu['ip'].replace('.', '_')}",
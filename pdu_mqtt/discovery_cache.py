@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Discovery Result Cache
+Persists device fingerprints between scans so repeat scans only probe what changed
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = '/data/discovery_cache.json'
+
+class DiscoveryCache:
+    """Fingerprint results keyed by IP and MAC, each with its own TTL"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, device_ttl=3600, empty_ttl=900):
+        self.path = path
+        self.device_ttl = device_ttl
+        self.empty_ttl = empty_ttl
+        self.entries = {}  # ip -> {'ip', 'mac', 'device', 'checked'}
+        self.macs = {}     # mac -> ip
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Load cached entries from disk"""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            for entry in data.get('entries', []):
+                self.entries[entry['ip']] = entry
+                if entry.get('mac'):
+                    self.macs[entry['mac']] = entry['ip']
+            logger.info(f"Loaded {len(self.entries)} cached discovery entries")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable discovery cache {self.path}: {e}")
+
+    def save(self):
+        """Write the cache to disk atomically"""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            return
+
+        with self._lock:
+            data = {'entries': list(self.entries.values())}
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Could not save discovery cache: {e}")
+
+    def is_fresh(self, entry, now=None):
+        """Check whether a cached entry is still within its TTL"""
+        now = now or time.time()
+        ttl = self.device_ttl if entry.get('device') else self.empty_ttl
+        return now - entry.get('checked', 0) < ttl
+
+    def store(self, ip, device, mac=None, now=None):
+        """Record the fingerprint result for an IP (None when nothing was found)"""
+        mac = (mac or (device or {}).get('mac') or '').lower() or None
+        with self._lock:
+            previous = self.entries.get(ip, {})
+            previous_mac = previous.get('mac')
+            mac = mac or previous_mac
+            if previous_mac and previous_mac != mac and self.macs.get(previous_mac) == ip:
+                # Another device took over this address; forget where the old one was
+                del self.macs[previous_mac]
+            if mac:
+                # A MAC seen at a new address means the device moved, unless
+                # its old address already belongs to another device
+                old_ip = self.macs.get(mac)
+                if old_ip and old_ip != ip and self.entries.get(old_ip, {}).get('mac') == mac:
+                    del self.entries[old_ip]
+                self.macs[mac] = ip
+            self.entries[ip] = {
+                'ip': ip,
+                'mac': mac,
+                'device': device,
+                'checked': now or time.time()
+            }
+
+    def lookup_mac(self, mac):
+        """Return the cached entry for a MAC address, if any"""
+        with self._lock:
+            ip = self.macs.get(mac.lower())
+            return dict(self.entries[ip]) if ip in self.entries else None
+
+    def plan(self, ips, now=None):
+        """Split a scan range into cached devices, skipped hosts and hosts to probe
+
+        Hosts with an expired device entry are returned first in the probe list
+        so known devices are rechecked before the rest of the range.
+        """
+        now = now or time.time()
+        cached, skipped, known, unknown = [], [], [], []
+        with self._lock:
+            for ip in ips:
+                entry = self.entries.get(ip)
+                if entry is None:
+                    unknown.append(ip)
+                elif self.is_fresh(entry, now):
+                    if entry.get('device'):
+                        cached.append(dict(entry['device'], cached=True))
+                    else:
+                        skipped.append(ip)
+                elif entry.get('device'):
+                    known.append(ip)
+                else:
+                    unknown.append(ip)
+        return cached, skipped, known + unknown
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Discovery Monitor
+Runs periodic background scans and publishes inventory changes over MQTT
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INVENTORY_PATH = '/data/discovery_inventory.json'
+
+# Seconds before retrying a background scan that could not run as a full rescan
+RETRY_DELAY = 60
+
+# Fields whose change is reported; everything else (cache flags, capabilities) is noise
+TRACKED_FIELDS = ('type', 'model', 'auth_required', 'mac', 'port')
+
+def diff_inventories(previous, current):
+    """Compare two {ip: device} inventories
+
+    Returns (new, vanished, changed) where changed is a list of
+    (device, {field: [old, new]}) tuples.
+    """
+    new = [device for ip, device in current.items() if ip not in previous]
+    vanished = [device for ip, device in previous.items() if ip not in current]
+    changed = []
+    for ip, device in current.items():
+        old = previous.get(ip)
+        if old is None:
+            continue
+        changes = {
+            field: [old.get(field), device.get(field)]
+            for field in TRACKED_FIELDS
+            if old.get(field) != device.get(field)
+        }
+        if changes:
+            changed.append((device, changes))
+    return new, vanished, changed
+
+class DiscoveryMonitor:
+    """Keeps the last inventory per scan range and publishes what changed"""
+
+    def __init__(self, scan_manager, publish, topic_prefix, network, range_start, range_end,
+                 interval=3600, path=DEFAULT_INVENTORY_PATH):
+        self.scan_manager = scan_manager
+        self.publish = publish  # publish(topic, payload, retain)
+        self.topic_prefix = topic_prefix
+        self.network = network
+        self.range_start = range_start
+        self.range_end = range_end
+        self.interval = interval
+        self.path = path
+        self.inventories = self._load()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        scan_manager.add_listener(self.on_scan_finished)
+
+    @property
+    def event_topic(self):
+        return f"{self.topic_prefix}/discovery/event"
+
+    @property
+    def state_topic(self):
+        return f"{self.topic_prefix}/discovery/state"
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable discovery inventory {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.inventories, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Could not save discovery inventory: {e}")
+
+    def discovery_config(self):
+        """Home Assistant MQTT discovery message for the inventory sensor"""
+        entity_id = f"{self.topic_prefix}_discovered_devices"
+        config = {
+            "name": "Discovered Devices",
+            "unique_id": entity_id,
+            "object_id": entity_id,
+            "state_topic": self.state_topic,
+            "value_template": "{{ value_json.devices }}",
+            "json_attributes_topic": self.state_topic,
+            "unit_of_measurement": "devices",
+            "icon": "mdi:lan",
+            "device": {
+                "identifiers": [f"{self.topic_prefix}_discovery"],
+                "name": "Device Discovery",
+                "model": "Device MQTT Bridge",
+                "manufacturer": "LogiLink"
+            }
+        }
+        return f"homeassistant/sensor/{entity_id}/config", json.dumps(config)
+
+    def on_scan_finished(self, job):
+        """Scan manager callback: diff a completed scan against the last one of its range
+
+        Only full rescans count: a cache-backed scan returns devices that were
+        merely remembered, which says nothing about whether they are still there.
+        """
+        if job.status != 'completed' or not job.refresh:
+            return
+
+        key = f"{job.network}.{job.start}-{job.end}"
+        current = {device['ip']: device for device in job.results.snapshot()['discovered_devices']}
+
+        with self._lock:
+            previous = self.inventories.get(key)
+            self.inventories[key] = current
+            self._save()
+
+        if previous is None:
+            # First scan of this range only sets the baseline
+            new, vanished, changed = [], [], []
+        else:
+            new, vanished, changed = diff_inventories(previous, current)
+
+        for device in new:
+            self._publish_event('new', device)
+        for device in vanished:
+            self._publish_event('vanished', device)
+        for device, changes in changed:
+            self._publish_event('changed', device, changes)
+
+        state = {
+            'range': key,
+            'devices': len(current),
+            'new': len(new),
+            'vanished': len(vanished),
+            'changed': len(changed),
+            'last_scan': datetime.now().isoformat(timespec='seconds')
+        }
+        self.publish(self.state_topic, json.dumps(state), True)
+        logger.info(f"Discovery diff for {key}: {len(new)} new, {len(vanished)} vanished, {len(changed)} changed")
+
+    def _publish_event(self, event, device, changes=None):
+        payload = {'event': event, 'ip': device.get('ip'), 'type': device.get('type'), 'model': device.get('model')}
+        if changes:
+            payload['changes'] = changes
+        self.publish(self.event_topic, json.dumps(payload), False)
+
+    def start(self, initial_delay=30):
+        """Start periodic background rescans of the configured range"""
+        thread = threading.Thread(target=self._run, args=(initial_delay,), name='discovery-monitor', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, initial_delay):
+        if self._stop.wait(initial_delay):
+            return
+        while True:
+            delay = self.interval
+            try:
+                # refresh bypasses the discovery cache so every host is probed again
+                job, created = self.scan_manager.submit(self.network, self.range_start, self.range_end,
+                                                        refresh=True)
+                logger.info(f"Background discovery scan {job.id} {'queued' if created else 'joined'}")
+                if not created and not job.refresh:
+                    # A cache-backed scan of the range is running; try again once it is done
+                    delay = RETRY_DELAY
+            except Exception as e:
+                logger.warning(f"Background discovery scan not started: {e}")
+                delay = RETRY_DELAY
+            if self._stop.wait(delay):
+                return
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Energy Accounting
+Integrates PDU current readings into kWh totals that survive restarts
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENERGY_PATH = '/data/energy.json'
+
+def parse_current(value):
+    """Current in A from a raw PDU reading, or None if it can't be read"""
+    try:
+        current = float(value)
+    except (TypeError, ValueError):
+        return None
+    return current if current >= 0 else None
+
+class EnergyMeter:
+    """Running kWh total per device from successive current samples
+
+    Each sample adds the trapezoid between it and the previous sample
+    (V * (I1 + I2) / 2 * dt), so an update is O(1) whatever the poll rate.
+    When two samples are further apart than max_gap (PDU offline, bridge
+    restarted) the interval is not integrated: the total resumes from the
+    next sample instead of guessing what was drawn in between.
+
+    Totals are written to disk at most every save_interval seconds and on
+    shutdown (the bridge saves on SIGTERM), so a crash loses at most that
+    much accounting.
+    """
+
+    def __init__(self, voltage=230.0, max_gap=300, path=DEFAULT_ENERGY_PATH, save_interval=60):
+        self.voltage = float(voltage)
+        self.max_gap = max_gap
+        self.path = path
+        self.save_interval = save_interval
+        self.totals = self._load()  # name -> kWh
+        self.last = {}  # name -> (monotonic time, current)
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return {name: float(kwh) for name, kwh in json.load(f).get('totals', {}).items()}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable energy totals {self.path}: {e}")
+            return {}
+
+    def save(self):
+        """Write the totals if they changed since the last save"""
+        with self._lock:
+            if not self.dirty:
+                return
+            totals = dict(self.totals)
+            self.dirty = False
+            self.last_save = time.monotonic()
+        try:
+            # Write then rename so a crash never leaves a truncated file
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'voltage': self.voltage, 'totals': totals, 'saved': time.time()}, f)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.debug(f"Could not save energy totals: {e}")
+
+    def add_sample(self, name, value, timestamp=None):
+        """Add a current reading (A) for a device; returns its total kWh"""
+        current = parse_current(value)
+        now = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            total = self.totals.get(name, 0.0)
+            if current is None:
+                # An unreadable sample breaks the series, like a gap
+                self.last.pop(name, None)
+                return total
+
+            previous = self.last.get(name)
+            self.last[name] = (now, current)
+            if previous is not None:
+                elapsed = now - previous[0]
+                if 0 < elapsed <= self.max_gap:
+                    # W * s -> kWh
+                    total += self.voltage * (previous[1] + current) / 2 * elapsed / 3600000
+                    self.totals[name] = total
+                    self.dirty = True
+                elif elapsed > self.max_gap:
+                    logger.debug(f"Energy for {name}: {elapsed:.0f} s without samples, not integrated")
+            elif name not in self.totals:
+                self.totals[name] = total
+                self.dirty = True
+            save_due = self.dirty and time.monotonic() - self.last_save >= self.save_interval
+        if save_due:
+            self.save()
+        return total
+
+    def get(self, name):
+        with self._lock:
+            return self.totals.get(name)
+
+# Global instance; the bridge sets the voltage and gap from the add-on options
+energy_meter = EnergyMeter()
@@ -5,44 +5,200 @@ Fetches the current theme from Home Assistant and applies it to the web interfac
 """
 
 import requests
+import hashlib
 import json
 import logging
 import os
-from typing import Dict, Optional, Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional, Any
 
 logger = logging.getLogger(__name__)
 
+HA_URL_CACHE_PATH = '/data/ha_url.json'
+
+# Candidate URLs for Home Assistant as seen from inside an add-on container
+INTERNAL_HA_URLS = [
+    'http://supervisor/core',
+    'http://homeassistant:8123',
+    'http://127.0.0.1:8123',
+    'http://localhost:8123'
+]
+
+class TTLCache:
+    """Values that expire after a TTL, with one fetch in flight per key
+
+    Expired values keep being served while a single background fetch
+    replaces them (stale-while-revalidate), so callers never wait on HA
+    unless they ask to.
+    """
+
+    def __init__(self, ttl: float = 300, error_ttl: float = 30):
+        self.ttl = ttl
+        self.error_ttl = error_ttl  # Failed fetches (None) are retried sooner
+        self.entries = {}   # key -> (value, expires_at)
+        self.inflight = {}  # key -> Event set when the fetch finishes
+        self.version = 0    # Bumped whenever a cached value actually changes
+        self.listeners = []  # Called with no arguments (under the lock) when a value changes
+        self._lock = threading.Lock()
+
+    def get(self, key: str, fetch: Callable[[], Any], default: Any = None, block: bool = False) -> Any:
+        """Return the cached value, starting a refresh if it is missing or expired
+
+        With block=False a missing value returns default immediately; with
+        block=True the caller waits for the (shared) fetch to finish.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and time.monotonic() < entry[1]:
+                return entry[0]
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = threading.Event()
+
+        if leader:
+            if block:
+                self._refresh(key, fetch, flight)
+            else:
+                threading.Thread(target=self._refresh, args=(key, fetch, flight),
+                                 name=f'ha-cache-{key}', daemon=True).start()
+        if block:
+            flight.wait()
+            with self._lock:
+                entry = self.entries.get(key)
+        return entry[0] if entry and entry[0] is not None else default
+
+    def _refresh(self, key, fetch, flight):
+        try:
+            value = fetch()
+        except Exception as e:
+            logger.error(f"Error refreshing {key}: {e}")
+            value = None
+        with self._lock:
+            ttl = self.ttl if value is not None else self.error_ttl
+            previous = self.entries.get(key)
+            if value is None and previous and previous[0] is not None:
+                value = previous[0]  # Keep serving the last good value while HA is down
+            self._store(key, value, ttl)
+            self.inflight.pop(key, None)
+        flight.set()
+
+    def _store(self, key, value, ttl):
+        """Store a value and notify listeners if it changed (caller holds the lock)"""
+        previous = self.entries.get(key)
+        self.entries[key] = (value, time.monotonic() + ttl)
+        if previous is None or previous[0] != value:
+            self.version += 1
+            self._notify()
+
+    def _notify(self):
+        for callback in self.listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Theme cache listener failed: {e}")
+
+    def put(self, key: str, value: Any):
+        """Replace a value pushed from elsewhere, resetting its TTL"""
+        with self._lock:
+            self._store(key, value, self.ttl)
+
+    def peek(self, key: str) -> Any:
+        """Return the cached value without triggering a refresh"""
+        with self._lock:
+            entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def invalidate(self):
+        with self._lock:
+            self.entries.clear()
+            self.version += 1
+            self._notify()
+
 class HomeAssistantThemeIntegration:
-    def __init__(self):
-        self.ha_url = self._get_ha_url()
+    def __init__(self, cache_ttl: float = 300, url_cache_path: str = HA_URL_CACHE_PATH):
         self.ha_token = self._get_ha_token()
-        self.cached_theme = None
+        self.cache = TTLCache(cache_ttl)
+        self.url_cache_path = url_cache_path
         self.default_theme_variables = self._get_default_theme_variables()
+        self._ha_url = None  # Resolved on first use, never at import time
+        self._memo = {}      # key -> (cache version, body, etag)
+        self._ws_theme = None  # Default theme last pushed over the WebSocket
+        self.watcher = None
+        self._url_lock = threading.Lock()
+    
+    @property
+    def ha_url(self) -> str:
+        """Home Assistant URL, resolved once on first use"""
+        if self._ha_url is None:
+            with self._url_lock:
+                if self._ha_url is None:
+                    self._ha_url = self._get_ha_url()
+        return self._ha_url
     
     def _get_ha_url(self) -> str:
-        """Get Home Assistant URL from environment or default"""
+        """Get Home Assistant URL from environment, the saved winner or a probe"""
         # Try different possible sources for HA URL
         ha_url = os.environ.get('HOMEASSISTANT_URL', 'http://homeassistant.local:8123')
+        if 'homeassistant.local' not in ha_url:
+            return ha_url
+        
+        try:
+            with open(self.url_cache_path, 'r') as f:
+                cached_url = json.load(f).get('url')
+            if cached_url:
+                logger.debug(f"Using saved Home Assistant URL {cached_url}")
+                return cached_url
+        except:
+            pass
         
         # For Home Assistant add-ons, try common internal URLs
-        if 'homeassistant.local' in ha_url:
-            internal_urls = [
-                'http://supervisor/core',
-                'http://homeassistant:8123',
-                'http://127.0.0.1:8123',
-                'http://localhost:8123'
-            ]
-            
-            for url in internal_urls:
+        url = self._probe_urls(INTERNAL_HA_URLS)
+        if not url:
+            logger.warning(f"No internal Home Assistant URL answered, using {ha_url}")
+            return ha_url
+        
+        try:
+            with open(self.url_cache_path, 'w') as f:
+                json.dump({'url': url}, f)
+        except Exception as e:
+            logger.debug(f"Could not save Home Assistant URL: {e}")
+        return url
+    
+    def _probe_urls(self, urls, timeout: float = 2) -> Optional[str]:
+        """Probe candidate URLs concurrently and return the first that answers like HA"""
+        headers = {'Authorization': f'Bearer {self.ha_token}'} if self.ha_token else {}
+        
+        def probe(url):
+            response = requests.get(f"{url}/api/", headers=headers, timeout=timeout)
+            # 401 still means the HA API is there, just without a valid token
+            return url if response.status_code in (200, 401) else None
+        
+        executor = ThreadPoolExecutor(max_workers=len(urls))
+        try:
+            futures = [executor.submit(probe, url) for url in urls]
+            for future in as_completed(futures):
                 try:
-                    response = requests.get(f"{url}/api/", timeout=2)
-                    if response.status_code == 200:
-                        ha_url = url
-                        break
-                except:
+                    url = future.result()
+                except Exception:
                     continue
-        
-        return ha_url
+                if url:
+                    logger.info(f"Found Home Assistant at {url}")
+                    return url
+        finally:
+            executor.shutdown(wait=False)
+        return None
+    
+    def _forget_ha_url(self):
+        """Drop a resolved URL that stopped answering so the next use probes again"""
+        with self._url_lock:
+            self._ha_url = None
+        try:
+            os.remove(self.url_cache_path)
+        except OSError:
+            pass
     
     def _get_ha_token(self) -> Optional[str]:
         """Get Home Assistant long-lived access token"""
@@ -123,115 +279,98 @@ class HomeAssistantThemeIntegration:
             '--device-unknown-color': '#9e9e9e',
         }
     
-    def get_current_theme(self) -> Optional[Dict[str, Any]]:
-        """Get the current theme from Home Assistant"""
-        if not self.ha_url or not self.ha_token:
+    def _headers(self) -> Dict[str, str]:
+        return {
+            'Authorization': f'Bearer {self.ha_token}',
+            'Content-Type': 'application/json'
+        }
+    
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Call the HA API, forgetting the URL if HA is no longer there"""
+        try:
+            return requests.request(method, f"{self.ha_url}{path}", headers=self._headers(), timeout=5, **kwargs)
+        except requests.exceptions.ConnectionError:
+            self._forget_ha_url()
+            raise
+    
+    def _fetch_current_theme(self) -> Optional[Dict[str, Any]]:
+        """Fetch the HA config and current theme (two API calls)"""
+        if not self.ha_token or not self.ha_url:
             logger.warning("Home Assistant URL or token not available")
             return None
         
-        try:
-            # Get current config including frontend settings
-            headers = {
-                'Authorization': f'Bearer {self.ha_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            # Try to get frontend config
-            response = requests.get(
-                f"{self.ha_url}/api/config",
-                headers=headers,
-                timeout=5
-            )
-            
-            if response.status_code == 200:
-                config = response.json()
-                logger.info(f"Retrieved HA config: {config.get('version', 'unknown')}")
-                
-                # Try to get current theme via states
-                states_response = requests.get(
-                    f"{self.ha_url}/api/states",
-                    headers=headers,
-                    timeout=5
-                )
-                
-                if states_response.status_code == 200:
-                    states = states_response.json()
-                    
-                    # Look for frontend entity with theme info
-                    for state in states:
-                        if state.get('entity_id') == 'frontend':
-                            attributes = state.get('attributes', {})
-                            theme = attributes.get('theme', 'default')
-                            logger.info(f"Current theme: {theme}")
-                            return {'theme': theme, 'config': config}
-                
-                return {'theme': 'default', 'config': config}
-            
-        except Exception as e:
-            logger.error(f"Error getting HA theme: {e}")
+        # Get current config including frontend settings
+        response = self._request('GET', '/api/config')
+        if response.status_code != 200:
+            return None
         
-        return None
+        config = response.json()
+        logger.info(f"Retrieved HA config: {config.get('version', 'unknown')}")
+        
+        # A theme pushed before the WebSocket dropped may be stale; ask the REST API instead
+        if self._ws_theme is not None and self.watcher and self.watcher.connected:
+            return {'theme': self._ws_theme, 'config': config}
+        
+        # Only the frontend entity carries theme info; don't download every state
+        state_response = self._request('GET', '/api/states/frontend')
+        theme = 'default'
+        if state_response.status_code == 200:
+            theme = state_response.json().get('attributes', {}).get('theme', 'default')
+            logger.info(f"Current theme: {theme}")
+        
+        return {'theme': theme, 'config': config}
     
-    def get_theme_variables(self, theme_name: str = None) -> Dict[str, str]:
-        """Get theme variables from Home Assistant"""
+    def _fetch_themes(self) -> Optional[Dict[str, Any]]:
+        """Fetch all theme definitions from HA"""
+        if not self.ha_token or not self.ha_url:
+            return None
+        
+        response = self._request('POST', '/api/services/frontend/get_themes', json={})
+        if response.status_code != 200:
+            return None
+        
+        themes_data = response.json()
+        logger.info(f"Retrieved themes data: {list(themes_data.keys())}")
+        return themes_data
+    
+    def get_current_theme(self, block: bool = False) -> Optional[Dict[str, Any]]:
+        """Get the current theme from Home Assistant (cached)"""
+        return self.cache.get('current_theme', self._fetch_current_theme, block=block)
+    
+    def get_theme_variables(self, theme_name: str = None, block: bool = False) -> Dict[str, str]:
+        """Get theme variables from Home Assistant (cached)"""
         if not theme_name:
-            theme_info = self.get_current_theme()
-            if theme_info:
-                theme_name = theme_info.get('theme', 'default')
-            else:
-                theme_name = 'default'
+            theme_info = self.get_current_theme(block=block)
+            theme_name = theme_info.get('theme', 'default') if theme_info else 'default'
         
-        # If we can't get theme from HA, use defaults
-        if not self.ha_url or not self.ha_token:
-            return self.default_theme_variables
+        themes_data = self.cache.get('themes', self._fetch_themes, block=block)
+        theme_vars = self.default_theme_variables.copy()
         
-        try:
-            headers = {
-                'Authorization': f'Bearer {self.ha_token}',
-                'Content-Type': 'application/json'
-            }
+        if themes_data and theme_name != 'default' and theme_name in themes_data:
+            theme_config = themes_data[theme_name]
             
-            # Try to get themes configuration
-            response = requests.post(
-                f"{self.ha_url}/api/services/frontend/get_themes",
-                headers=headers,
-                json={},
-                timeout=5
-            )
-            
-            if response.status_code == 200:
-                themes_data = response.json()
-                logger.info(f"Retrieved themes data: {list(themes_data.keys())}")
-                
-                # Get theme variables
-                theme_vars = self.default_theme_variables.copy()
-                
-                if theme_name != 'default' and theme_name in themes_data:
-                    theme_config = themes_data[theme_name]
-                    
-                    # Update with theme-specific variables
-                    for key, value in theme_config.items():
-                        if key.startswith('--') or key in ['primary-color', 'accent-color']:
-                            theme_vars[f'--{key}' if not key.startswith('--') else key] = value
-                
-                return theme_vars
-                
-        except Exception as e:
-            logger.error(f"Error getting theme variables: {e}")
+            # Update with theme-specific variables
+            for key, value in theme_config.items():
+                if key.startswith('--') or key in ['primary-color', 'accent-color']:
+                    theme_vars[f'--{key}' if not key.startswith('--') else key] = value
         
-        return self.default_theme_variables
+        return theme_vars
+    
+    @staticmethod
+    def _is_dark_theme(theme_name: str) -> bool:
+        return 'dark' in theme_name.lower() or 'night' in theme_name.lower()
     
     def detect_dark_mode(self) -> bool:
         """Detect if the current theme is dark mode"""
         theme_info = self.get_current_theme()
         if theme_info:
-            theme_name = theme_info.get('theme', 'default')
-            return 'dark' in theme_name.lower() or 'night' in theme_name.lower()
+            return self._is_dark_theme(theme_info.get('theme', 'default'))
         return False
     
-    def generate_css_variables(self, theme_name: str = None) -> str:
+    def generate_css_variables(self, theme_name: str = None, variables: Dict[str, str] = None) -> str:
         """Generate CSS variables string for the current theme"""
-        variables = self.get_theme_variables(theme_name)
+        if variables is None:
+            variables = self.get_theme_variables(theme_name)
         
         css_vars = []
         for key, value in variables.items():
@@ -261,30 +400,102 @@ class HomeAssistantThemeIntegration:
         
         return ':root {\n' + '\n'.join(css_vars) + '\n}'
     
-    def get_theme_info(self) -> Dict[str, Any]:
-        """Get comprehensive theme information"""
-        theme_info = self.get_current_theme()
+    def get_theme_info(self, block: bool = False) -> Dict[str, Any]:
+        """Get comprehensive theme information
+        
+        Served from the cache; while it is still warming up the defaults are
+        returned instead of waiting on Home Assistant (unless block=True).
+        """
+        theme_info = self.get_current_theme(block=block)
+        # Warm the theme definitions alongside the current theme
+        self.cache.get('themes', self._fetch_themes, block=block)
         
         if not theme_info:
             return {
                 'theme_name': 'default',
                 'is_dark': False,
                 'variables': self.default_theme_variables,
-                'css': self.generate_css_variables(),
+                'css': self.generate_css_variables(variables=self.default_theme_variables),
                 'ha_available': False
             }
         
         theme_name = theme_info.get('theme', 'default')
-        variables = self.get_theme_variables(theme_name)
+        variables = self.get_theme_variables(theme_name, block=block)
         
         return {
             'theme_name': theme_name,
-            'is_dark': self.detect_dark_mode(),
+            'is_dark': self._is_dark_theme(theme_name),
             'variables': variables,
-            'css': self.generate_css_variables(theme_name),
+            'css': self.generate_css_variables(variables=variables),
             'ha_available': True,
             'ha_version': theme_info.get('config', {}).get('version', 'unknown')
         }
+    
+    def _memoized(self, key, build: Callable[[], str]):
+        """Render and hash a response body once per version of the cached HA data"""
+        # Touch the cached HA data so expired entries are still revalidated
+        self.get_current_theme()
+        self.cache.get('themes', self._fetch_themes)
+        
+        version = self.cache.version
+        memo = self._memo.get(key)
+        if memo and memo[0] == version:
+            return memo[1], memo[2]
+        
+        body = build()
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        if len(self._memo) > 32:
+            self._memo.clear()
+        self._memo[key] = (version, body, etag)
+        return body, etag
+    
+    def get_theme_css(self, theme_name: str = None):
+        """Theme CSS and its content hash, as (css, etag)"""
+        return self._memoized(('css', theme_name), lambda: self.generate_css_variables(theme_name))
+    
+    def get_theme_info_json(self):
+        """Serialized theme info and its content hash, as (json, etag)"""
+        return self._memoized(('info',), lambda: json.dumps(self.get_theme_info()))
+    
+    def apply_themes(self, result: Dict[str, Any]):
+        """Update the cache in place from a frontend/get_themes result"""
+        theme = result.get('default_theme') or 'default'
+        self._ws_theme = theme
+        self.cache.put('themes', result.get('themes', {}))
+        current = self.cache.peek('current_theme') or {'config': {}}
+        if current.get('theme') != theme:
+            logger.info(f"Home Assistant theme changed to {theme}")
+        self.cache.put('current_theme', dict(current, theme=theme))
+    
+    def start_watcher(self, ws_url: str = None):
+        """Follow theme changes over the HA WebSocket API instead of waiting for the TTL"""
+        if not self.ha_token:
+            logger.info("No Home Assistant token - theme updates will be polled")
+            return None
+        
+        try:
+            from ha_websocket import HAThemeWatcher, websocket_url
+        except ImportError as e:
+            logger.warning(f"Home Assistant WebSocket not available: {e}")
+            return None
+        
+        ws_url = ws_url or os.environ.get('HOMEASSISTANT_WS_URL')
+        self.watcher = HAThemeWatcher(
+            lambda: ws_url or websocket_url(self.ha_url),
+            self.ha_token,
+            self.apply_themes
+        )
+        self.watcher.start()
+        return self.watcher
+    
+    def add_listener(self, callback: Callable[[], None]):
+        """Call callback() whenever cached HA theme data changes"""
+        self.cache.listeners.append(callback)
+    
+    def refresh(self) -> Dict[str, Any]:
+        """Drop cached HA data and fetch it again, waiting for the result"""
+        self.cache.invalidate()
+        return self.get_theme_info(block=True)
 
 # Global instance
 ha_theme_integration = HomeAssistantThemeIntegration()
\ No newline at end of file
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Home Assistant WebSocket Theme Watcher
+Keeps a WebSocket subscription to Home Assistant and reports theme changes as they happen
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+def websocket_url(ha_url: str) -> str:
+    """WebSocket endpoint for an HA base URL (the Supervisor proxy uses /core/websocket)"""
+    ws_url = ha_url.rstrip('/').replace('https://', 'wss://', 1).replace('http://', 'ws://', 1)
+    if ws_url.endswith('/core'):
+        return f"{ws_url}/websocket"
+    return f"{ws_url}/api/websocket"
+
+class HAThemeWatcher:
+    """Background WebSocket client that calls on_themes with every frontend/get_themes result
+
+    The connection authenticates, subscribes to themes_updated and asks for
+    the current themes; each themes_updated event triggers a new request.
+    It reconnects with exponential backoff until stopped.
+    """
+
+    def __init__(self, url: Callable[[], str], token: str, on_themes: Callable[[Dict[str, Any]], None],
+                 max_backoff: float = 60):
+        self.url = url  # Called on every connect so a re-resolved HA URL is picked up
+        self.token = token
+        self.on_themes = on_themes
+        self.max_backoff = max_backoff
+        self.connected = False
+        self._loop = None
+        self._stop = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='ha-websocket', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        if self._loop and self._stop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._watch())
+        finally:
+            self._loop.close()
+
+    async def _watch(self):
+        self._stop = asyncio.Event()
+        backoff = 1
+        async with aiohttp.ClientSession() as session:
+            while not self._stop.is_set():
+                url = self.url()
+                try:
+                    await self._session(session, url)
+                    backoff = 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Home Assistant WebSocket {url} failed: {e}")
+                finally:
+                    self.connected = False
+
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _session(self, session, url):
+        async with session.ws_connect(url, heartbeat=30) as ws:
+            message = await ws.receive_json()
+            if message.get('type') == 'auth_required':
+                await ws.send_json({'type': 'auth', 'access_token': self.token})
+                message = await ws.receive_json()
+            if message.get('type') != 'auth_ok':
+                raise ConnectionError(f"authentication failed: {message.get('message', message.get('type'))}")
+
+            message_id = 1
+            await ws.send_json({'id': message_id, 'type': 'subscribe_events', 'event_type': 'themes_updated'})
+            message_id += 1
+            themes_request = message_id
+            await ws.send_json({'id': themes_request, 'type': 'frontend/get_themes'})
+            self.connected = True
+            logger.info(f"Subscribed to Home Assistant theme updates at {url}")
+
+            stop_wait = asyncio.ensure_future(self._stop.wait())
+            try:
+                while True:
+                    receive = asyncio.ensure_future(ws.receive())
+                    done, _ = await asyncio.wait({receive, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+                    if stop_wait in done:
+                        receive.cancel()
+                        return
+                    msg = receive.result()
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        raise ConnectionError(f"connection closed ({msg.type.name})")
+
+                    message = msg.json()
+                    if message.get('type') == 'event':
+                        # themes_updated carries no payload; ask for the new themes
+                        message_id += 1
+                        themes_request = message_id
+                        await ws.send_json({'id': themes_request, 'type': 'frontend/get_themes'})
+                    elif message.get('type') == 'result' and message.get('id') == themes_request:
+                        if message.get('success'):
+                            try:
+                                self.on_themes(message.get('result') or {})
+                            except Exception as e:
+                                logger.error(f"Error applying theme update: {e}")
+                        else:
+                            logger.warning(f"frontend/get_themes failed: {message.get('error')}")
+            finally:
+                stop_wait.cancel()
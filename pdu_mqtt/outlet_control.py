@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Outlet Control
+Runs outlet commands concurrently across PDUs while keeping each PDU to one request at a time
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from state_store import device_state_store
+
+logger = logging.getLogger(__name__)
+
+def parse_state(value):
+    """Accept ON/OFF, on/off, true/false or 1/0 and return a bool"""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('on', 'true', '1'):
+        return True
+    if text in ('off', 'false', '0'):
+        return False
+    raise ValueError(f"Invalid outlet state: {value}")
+
+class OutletController:
+    """Executor for outlet commands with one FIFO queue per device
+
+    Each device has its own single-worker executor, so its commands run
+    one at a time in exactly the order they were submitted (a quick ON then
+    OFF always ends OFF), while different devices run in parallel. A lock
+    per device also keeps status polls (device_lock) from overlapping a
+    command, because the PDUs handle one HTTP request at a time.
+    """
+
+    def __init__(self):
+        self.devices = {}    # name -> PDU
+        self.locks = {}      # name -> Lock
+        self.queues = {}     # name -> single-worker executor
+        self.listeners = []  # callback(result), called after every command
+        # Commands for unregistered names only produce an error result
+        self.unknown_queue = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outlet-unknown')
+
+    def register(self, name, device):
+        self.devices[name] = device
+        self.locks.setdefault(name, threading.Lock())
+        if name not in self.queues:
+            self.queues[name] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'outlet-{name}')
+
+    def _queue(self, name):
+        return self.queues.get(name, self.unknown_queue)
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    @contextmanager
+    def device_lock(self, name):
+        """Hold a device exclusively, e.g. while polling its status"""
+        lock = self.locks.get(name)
+        if lock is None:
+            yield
+            return
+        with lock:
+            yield
+
+    def read_status(self, name):
+        """Poll a device's status while holding its lock ({} if unknown or unreachable)"""
+        device = self.devices.get(name)
+        if device is None:
+            return {}
+        with self.locks[name]:
+            return device.status() or {}
+
+    def _execute(self, name, outlet, state, origin):
+        """Run one command now (on the calling thread) and return its result"""
+        result = {
+            'device': name,
+            'outlet': outlet,
+            'state': 'on' if state else 'off',
+            'success': False,
+            'error': None,
+            'started_ms': round((time.monotonic() - origin) * 1000, 1)
+        }
+        device = self.devices.get(name)
+        started = time.monotonic()
+        if device is None:
+            result['error'] = f"Unknown device: {name}"
+        else:
+            try:
+                with self.locks[name]:
+                    started = time.monotonic()
+                    result['success'] = bool(device.set_outlet(outlet, state))
+                if not result['success']:
+                    result['error'] = 'Device rejected the command'
+            except Exception as e:
+                result['error'] = str(e)
+        result['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+        if result['success']:
+            device_state_store.set_item(name, 'outlets', outlet - 1, result['state'])
+        for callback in self.listeners:
+            try:
+                callback(result)
+            except Exception as e:
+                logger.error(f"Outlet listener failed: {e}")
+        return result
+
+    def submit(self, name, outlet, state):
+        """Queue a single command behind the device's earlier ones; returns a Future of its result"""
+        return self._queue(name).submit(self._execute, name, outlet, state, time.monotonic())
+
+    def submit_bulk(self, operations, results=None, abandoned=None):
+        """Queue (device, outlet, state) operations without waiting; returns the futures
+
+        Operations are grouped per device; each group is queued as one task
+        on its device's queue, so it runs in order and after that device's
+        earlier commands, and the groups run in parallel. Results are written
+        into the optional results list at the index of their operation.
+        """
+        origin = time.monotonic()
+        groups = {}
+        for index, (name, outlet, state) in enumerate(operations):
+            groups.setdefault(name, []).append((index, outlet, state))
+
+        def run_group(name, items):
+            for index, outlet, state in items:
+                if abandoned is not None and abandoned.is_set():
+                    return  # Don't keep switching outlets after the caller gave up
+                result = self._execute(name, outlet, state, origin)
+                if results is not None:
+                    results[index] = result
+
+        return [self._queue(name).submit(run_group, name, items) for name, items in groups.items()]
+
+    def run_bulk(self, operations, timeout=None):
+        """Run (device, outlet, state) operations and return their results in input order"""
+        results = [None] * len(operations)
+        abandoned = threading.Event()
+        try:
+            wait(self.submit_bulk(operations, results, abandoned), timeout=timeout)
+        finally:
+            # Also on errors: whatever hasn't started yet is dropped
+            abandoned.set()
+
+        final = list(results)
+        for index, (name, outlet, state) in enumerate(operations):
+            if final[index] is None:
+                final[index] = {'device': name, 'outlet': outlet, 'state': 'on' if state else 'off',
+                                'success': False, 'error': 'Not completed before the timeout'}
+        return final
+
+# Global instance shared by the MQTT bridge and the web interface
+outlet_controller = OutletController()
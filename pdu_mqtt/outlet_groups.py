@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Outlet Groups
+Named sets of outlets across PDUs, switched together and tracked from live state changes
+"""
+
+import logging
+import threading
+
+from outlet_control import outlet_controller
+from state_store import device_state_store
+
+logger = logging.getLogger(__name__)
+
+def parse_member(member):
+    """Parse a 'pdu_name:outlet' member into (pdu_name, outlet)"""
+    device, sep, outlet = str(member).rpartition(':')
+    if not sep or not device:
+        raise ValueError(f"Group member must look like 'pdu_name:outlet': {member}")
+    return device, int(outlet)
+
+class OutletGroup:
+    """A group and its running count of members that are on"""
+
+    def __init__(self, name, members):
+        self.name = name
+        self.members = members  # [(device, outlet)]
+        self.states = {}        # (device, outlet) -> bool, once known
+        self.on_count = 0
+
+    @property
+    def state(self):
+        """ON only when every member is on"""
+        return 'ON' if self.on_count == len(self.members) else 'OFF'
+
+    def attributes(self):
+        return {
+            'on': self.on_count,
+            'total': len(self.members),
+            'known': len(self.states),
+            'members': [f"{device}:{outlet}" for device, outlet in self.members]
+        }
+
+class OutletGroupManager:
+    """Fans group commands out to the outlet executor and keeps group states current
+
+    Group state is updated from device state diffs: each changed outlet is
+    looked up in a member index and only the groups containing it adjust
+    their counters, so nothing is re-polled or re-scanned.
+    """
+
+    def __init__(self, controller, store):
+        self.controller = controller
+        self.groups = {}        # name -> OutletGroup
+        self.member_index = {}  # (device, outlet) -> [OutletGroup]
+        self.listeners = []     # callback(group), called when a group's state or count changes
+        self._lock = threading.Lock()
+        store.add_listener(self.on_state_change)
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def load(self, config):
+        """Create groups from the outlet_groups option: [{'name', 'outlets': ['pdu:1', ...]}]"""
+        for entry in config or []:
+            try:
+                name = entry['name']
+                members = [parse_member(member) for member in entry['outlets']]
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"Ignoring invalid outlet group {entry}: {e}")
+                continue
+            if not members:
+                logger.error(f"Ignoring outlet group {name} without outlets")
+                continue
+
+            group = OutletGroup(name, members)
+            with self._lock:
+                self.groups[name] = group
+                for member in members:
+                    self.member_index.setdefault(member, []).append(group)
+            logger.info(f"Loaded outlet group {name} with {len(members)} outlets")
+
+    def set(self, name, state):
+        """Switch every member of a group; returns the futures without waiting"""
+        group = self.groups.get(name)
+        if group is None:
+            raise KeyError(f"Unknown outlet group: {name}")
+        operations = [(device, outlet, state) for device, outlet in group.members]
+        logger.info(f"Switching outlet group {name} {'ON' if state else 'OFF'} ({len(operations)} outlets)")
+        return self.controller.submit_bulk(operations)
+
+    def on_state_change(self, name, diff, state):
+        """State store listener: apply changed outlets to the groups that contain them"""
+        outlets = diff.get('outlets')
+        if outlets is None:
+            return
+        changed = outlets.items() if isinstance(outlets, dict) else enumerate(outlets)
+
+        updated = []
+        with self._lock:
+            for index, value in changed:
+                member = (name, int(index) + 1)
+                is_on = value == 'on'
+                for group in self.member_index.get(member, ()):
+                    previous = group.states.get(member)
+                    if previous == is_on:
+                        continue
+                    group.states[member] = is_on
+                    group.on_count += (1 if is_on else 0) - (1 if previous else 0)
+                    if group not in updated:
+                        updated.append(group)
+
+        for group in updated:
+            for callback in self.listeners:
+                try:
+                    callback(group)
+                except Exception as e:
+                    logger.error(f"Outlet group listener failed for {group.name}: {e}")
+
+# Global instance; groups are loaded from the add-on options by the bridge
+outlet_group_manager = OutletGroupManager(outlet_controller, device_state_store)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Passive Device Discovery
+Listens for mDNS and SSDP announcements and keeps a live inventory of self-announcing devices
+"""
+
+import logging
+import re
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MDNS_ADDR = ('224.0.0.251', 5353)
+SSDP_ADDR = ('239.255.255.250', 1900)
+
+DNS_TYPE_A = 1
+DNS_TYPE_PTR = 12
+DNS_TYPE_TXT = 16
+DNS_TYPE_SRV = 33
+
+# Services queried at startup so devices answer without waiting for their next announcement
+MDNS_QUERY_SERVICES = ['_shelly._tcp.local', '_http._tcp.local']
+
+SHELLY_NAME_RE = re.compile(r'(shelly[a-z0-9]*)', re.IGNORECASE)
+
+# SSDP device and service types that can never be a PDU or a Shelly. The HTML
+# false positive keywords don't apply here: 'switch' would also match the
+# SwitchPower service that smart plugs and PDUs announce.
+SSDP_NON_TARGETS = (
+    'urn:schemas-upnp-org:device:mediarenderer',
+    'urn:schemas-upnp-org:device:mediaserver',
+    'urn:schemas-upnp-org:device:internetgatewaydevice',
+    'urn:schemas-upnp-org:device:wandevice',
+    'urn:schemas-upnp-org:service:avtransport',
+    'urn:schemas-upnp-org:service:renderingcontrol',
+    'urn:dial-multiscreen-org:',
+    'urn:schemas-sony-com:',
+    'roku:ecp',
+)
+
+def _read_name(data, offset):
+    """Read a possibly compressed DNS name, returning (name, next_offset)"""
+    labels = []
+    next_offset = None
+    for _ in range(128):  # Guards against pointer loops
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if next_offset is None:
+                next_offset = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode('utf-8', errors='replace'))
+        offset += length
+    return '.'.join(labels), next_offset if next_offset is not None else offset
+
+def parse_mdns_packet(data):
+    """Parse the answer, authority and additional records of an mDNS packet
+
+    Returns a list of (name, type, value) tuples: A records yield an IP
+    string, PTR a target name, SRV a (port, target) tuple and TXT a dict.
+    """
+    _, _, qdcount, ancount, nscount, arcount = struct.unpack('!HHHHHH', data[:12])
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = _read_name(data, offset)
+        offset += 4
+
+    records = []
+    for _ in range(ancount + nscount + arcount):
+        name, offset = _read_name(data, offset)
+        rtype, _, _, rdlength = struct.unpack('!HHIH', data[offset:offset + 10])
+        offset += 10
+        rdata = data[offset:offset + rdlength]
+
+        if rtype == DNS_TYPE_A and rdlength == 4:
+            records.append((name, rtype, socket.inet_ntoa(rdata)))
+        elif rtype == DNS_TYPE_PTR:
+            records.append((name, rtype, _read_name(data, offset)[0]))
+        elif rtype == DNS_TYPE_SRV:
+            port = struct.unpack('!H', rdata[4:6])[0]
+            records.append((name, rtype, (port, _read_name(data, offset + 6)[0])))
+        elif rtype == DNS_TYPE_TXT:
+            txt, i = {}, 0
+            while i < len(rdata):
+                length = rdata[i]
+                key, _, value = rdata[i + 1:i + 1 + length].decode('utf-8', errors='replace').partition('=')
+                txt[key.lower()] = value
+                i += 1 + length
+            records.append((name, rtype, txt))
+
+        offset += rdlength
+    return records
+
+def build_mdns_query(services):
+    """Build an mDNS PTR query for the given service names"""
+    packet = struct.pack('!HHHHHH', 0, 0, len(services), 0, 0, 0)
+    for service in services:
+        for label in service.split('.'):
+            packet += bytes([len(label)]) + label.encode()
+        packet += b'\x00' + struct.pack('!HH', DNS_TYPE_PTR, 1)
+    return packet
+
+def parse_ssdp_message(data):
+    """Parse SSDP NOTIFY / M-SEARCH response headers into a lower-case dict"""
+    lines = data.decode('utf-8', errors='replace').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        key, sep, value = line.partition(':')
+        if sep:
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+class PassiveListener:
+    """Background inventory of devices that announce themselves over mDNS and SSDP
+
+    The multicast addresses can be replaced with a unicast address (e.g.
+    127.0.0.1 and a free port) to run against a local fake responder.
+    """
+
+    def __init__(self, mdns_addr=MDNS_ADDR, ssdp_addr=SSDP_ADDR, ttl=1800, query_interval=300,
+                 detector=None):
+        self.mdns_addr = mdns_addr
+        self.ssdp_addr = ssdp_addr
+        self.ttl = ttl
+        self.query_interval = query_interval
+        self.detector = detector  # Optional DeviceDetector used to classify SSDP servers
+        self.inventory = {}  # ip -> entry
+        self.sockets = []
+        self.mdns_socket = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _open_socket(self, addr):
+        group, port = addr
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        if socket.inet_aton(group)[0] & 0xF0 == 0xE0:
+            sock.bind(('', port))
+            membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        else:
+            sock.bind(addr)
+        sock.settimeout(1.0)
+        return sock
+
+    def start(self):
+        """Open the listening sockets and start the background threads"""
+        for addr, handler, name in ((self.mdns_addr, self.handle_mdns, 'mdns'),
+                                    (self.ssdp_addr, self.handle_ssdp, 'ssdp')):
+            if not addr:
+                continue
+            try:
+                sock = self._open_socket(addr)
+            except OSError as e:
+                logger.warning(f"Passive {name} listener disabled: {e}")
+                continue
+            self.sockets.append(sock)
+            if name == 'mdns':
+                self.mdns_socket = sock
+            thread = threading.Thread(target=self._listen, args=(sock, handler, name),
+                                      name=f'passive-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        if self.mdns_socket and self.query_interval:
+            thread = threading.Thread(target=self._query_loop, name='passive-query', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for sock in self.sockets:
+            sock.close()
+
+    def _listen(self, sock, handler, name):
+        while not self._stop.is_set():
+            try:
+                data, addr = sock.recvfrom(9000)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                handler(data, addr[0])
+            except Exception as e:
+                logger.debug(f"Ignoring malformed {name} packet from {addr[0]}: {e}")
+
+    def _query_loop(self):
+        """Periodically ask mDNS responders to announce themselves"""
+        query = build_mdns_query(MDNS_QUERY_SERVICES)
+        while not self._stop.is_set():
+            try:
+                self.mdns_socket.sendto(query, self.mdns_addr)
+            except OSError as e:
+                logger.debug(f"mDNS query failed: {e}")
+            self._stop.wait(self.query_interval)
+
+    def _record(self, ip, **entry):
+        entry.update(ip=ip, last_seen=time.time())
+        with self._lock:
+            previous = self.inventory.get(ip)
+            self.inventory[ip] = entry
+        if not previous or previous.get('kind') != entry.get('kind'):
+            logger.info(f"Passive discovery: {entry.get('kind')} '{entry.get('name')}' at {ip}")
+
+    def handle_mdns(self, data, source_ip):
+        """Record Shelly devices from an mDNS response or announcement"""
+        if not struct.unpack('!H', data[2:4])[0] & 0x8000:
+            return  # Queries (including known-answer lists) say nothing about the sender
+        
+        records = parse_mdns_packet(data)
+        if not records:
+            return
+
+        names = [name for name, _, _ in records]
+        names += [value for _, rtype, value in records if rtype == DNS_TYPE_PTR]
+        addresses = [value for _, rtype, value in records if rtype == DNS_TYPE_A]
+        txt = {}
+        for _, rtype, value in records:
+            if rtype == DNS_TYPE_TXT:
+                txt.update(value)
+
+        shelly_name, device_name = None, names[0]
+        for name in names:
+            shelly_name = SHELLY_NAME_RE.search(name)
+            if shelly_name:
+                device_name = name
+                break
+        is_gen2_service = any('_shelly._tcp' in name for name in names)
+        if not shelly_name and not is_gen2_service:
+            return
+
+        ip = addresses[0] if addresses else source_ip
+        generation = int(txt['gen']) if txt.get('gen', '').isdigit() else (2 if is_gen2_service else 1)
+        model = txt.get('app') or (shelly_name.group(1) if shelly_name else 'Shelly')
+        self._record(ip, kind='shelly', source='mdns', name=device_name, model=model, generation=generation)
+
+    def handle_ssdp(self, data, source_ip):
+        """Record devices from SSDP NOTIFY messages and M-SEARCH responses"""
+        headers = parse_ssdp_message(data)
+        if headers.get('nts') == 'ssdp:byebye':
+            with self._lock:
+                self.inventory.pop(source_ip, None)
+            return
+
+        description = ' '.join(headers.get(key, '') for key in ('server', 'usn', 'nt', 'st'))
+        entry = {'kind': 'ssdp', 'source': 'ssdp', 'name': headers.get('server', ''),
+                 'location': headers.get('location')}
+        # Only positive identifications and known media/gateway types are
+        # trusted; anything else is still probed by active scans
+        if self.detector is not None and 'shelly' in self.detector.classify(description):
+            entry.update(kind='shelly', model='Shelly', generation=1)
+        elif any(marker in description.lower() for marker in SSDP_NON_TARGETS):
+            entry['kind'] = 'false_positive'
+        self._record(source_ip, **entry)
+
+    def lookup(self, ip):
+        """Return the fresh inventory entry for an IP, if any"""
+        with self._lock:
+            entry = self.inventory.get(ip)
+        if entry and time.time() - entry['last_seen'] < self.ttl:
+            return dict(entry)
+        return None
+
+    def device_for(self, entry):
+        """Build a discovery result for an announced Shelly device"""
+        generation = entry.get('generation', 1)
+        return {
+            'ip': entry['ip'],
+            'type': 'Shelly' if generation == 1 else 'Shelly Gen2',
+            'model': entry.get('model', 'Shelly'),
+            'generation': generation,
+            'capabilities': [],
+            'channels': 0,
+            'auth_required': False,
+            'endpoints': ['/status', '/relay/0', '/settings'] if generation == 1
+                         else ['/rpc/Shelly.GetStatus', '/rpc/Switch.Toggle'],
+            'mqtt_available': True,
+            'compatible': True,
+            'source': entry.get('source')
+        }
+
+    def partition(self, ips):
+        """Split hosts into announced devices, known non-targets and hosts still to probe"""
+        devices, ignored, remaining = [], [], []
+        for ip in ips:
+            entry = self.lookup(ip)
+            if entry and entry['kind'] == 'shelly':
+                devices.append(self.device_for(entry))
+            elif entry and entry['kind'] == 'false_positive':
+                ignored.append(ip)
+            else:
+                remaining.append(ip)
+        return devices, ignored, remaining
+
+    def get_inventory(self):
+        with self._lock:
+            return [dict(entry) for entry in self.inventory.values()]
@@ -1,20 +1,44 @@
 import requests
 import logging
+import re
 from xml.etree import ElementTree as ET
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_OUTLET_COUNT = 8
+OUTLET_STAT_RE = re.compile(r'<outletStat(\d+)>')
+
+def count_outlets(xml_text):
+    """Number of outlets reported in a status.xml document (0 if none)"""
+    indexes = [int(index) for index in OUTLET_STAT_RE.findall(xml_text)]
+    return max(indexes) + 1 if indexes else 0
+
 class PDU:
-    def __init__(self, host, username="admin", password="admin"):
+    def __init__(self, host, username="admin", password="admin", outlet_count=None):
         self.host = host
         self.auth = (username, password)
         self.session = requests.Session()
         self.status_url = f"http://{self.host}/status.xml"
         self.control_url = f"http://{self.host}/control_outlet.htm"
+        self.outlet_count = None
+        self.outlet_tags = []
+        if outlet_count:
+            self.set_outlet_count(outlet_count)
         logger.info(f"PDU initialized for host: {self.host}")
 
+    def set_outlet_count(self, count):
+        """Fix the number of outlets and precompute the status tags read on every poll"""
+        self.outlet_count = count
+        self.outlet_tags = [f"outletStat{i}" for i in range(count)]
+
+    def detect_outlet_count(self):
+        """Return the outlet count, reading it from the PDU the first time (None if unreachable)"""
+        if self.outlet_count is None:
+            self.status()
+        return self.outlet_count
+
     def status(self):
         try:
             logger.debug(f"Fetching status from {self.status_url}")
@@ -28,19 +52,20 @@ class PDU:
                 logger.error(f"Invalid XML response from {self.host}: {r.text[:200]}")
                 return {}
 
+            if self.outlet_count is None:
+                self.set_outlet_count(count_outlets(r.text) or DEFAULT_OUTLET_COUNT)
+                logger.info(f"Detected {self.outlet_count} outlets on {self.host}")
+
+            # One pass over the document instead of a search per outlet
             xml = ET.fromstring(r.text)
+            values = {child.tag: child.text for child in xml}
             data = {
-                "outlets": [],
-                "tempBan": xml.findtext("tempBan"),
-                "humBan": xml.findtext("humBan"),
-                "curBan": xml.findtext("curBan")
+                "outlets": [(values.get(tag) or "off").lower() for tag in self.outlet_tags],
+                "tempBan": values.get("tempBan"),
+                "humBan": values.get("humBan"),
+                "curBan": values.get("curBan")
             }
                 
-            for i in range(8):
-                tag = f"outletStat{i}"
-                val = xml.findtext(tag)
-                data["outlets"].append(val.lower() if val else "off")
-                
             logger.debug(f"Status for {self.host}: {data}")
             return data
             
@@ -55,8 +80,9 @@ class PDU:
             return {}
 
     def set_outlet(self, outlet_num, state):
-        if outlet_num < 1 or outlet_num > 8:
-            raise ValueError("Outlet number must be 1-8")
+        max_outlet = self.outlet_count or DEFAULT_OUTLET_COUNT
+        if outlet_num < 1 or outlet_num > max_outlet:
+            raise ValueError(f"Outlet number must be 1-{max_outlet}")
 
         try:
             # outletX is zero-indexed
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Power Sequencer
+Switches groups of outlets in order, starting each group as soon as the measured current allows
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from outlet_control import outlet_controller, parse_state
+
+logger = logging.getLogger(__name__)
+
+class SequenceError(Exception):
+    """Raised for invalid plans or plans that conflict with a running sequence"""
+
+def parse_plan(plan):
+    """Validate a sequence plan and return it in normalized form
+
+    A plan looks like:
+        {"name": "rack_a_on", "max_current": 10, "min_delay": 0.5,
+         "settle_timeout": 30, "poll_interval": 0.5, "stop_on_error": true,
+         "steps": [{"outlets": [{"device": "rack_a", "outlet": 1}], "state": "on", "delay": 2}]}
+
+    max_current (A, per PDU, from curBan) is optional; without it steps are
+    only separated by their delay.
+    """
+    if not isinstance(plan, dict) or not isinstance(plan.get('steps'), list) or not plan['steps']:
+        raise SequenceError("Plan must have a non-empty list of steps")
+
+    try:
+        normalized = {
+            'name': str(plan.get('name', 'sequence')),
+            'max_current': float(plan['max_current']) if plan.get('max_current') is not None else None,
+            'min_delay': float(plan.get('min_delay', 0.5)),
+            'settle_timeout': float(plan.get('settle_timeout', 30)),
+            'poll_interval': max(0.1, float(plan.get('poll_interval', 0.5))),
+            'stop_on_error': bool(plan.get('stop_on_error', True)),
+            'steps': []
+        }
+        for index, step in enumerate(plan['steps']):
+            outlets = [(str(item['device']), int(item['outlet'])) for item in step['outlets']]
+            if not outlets:
+                raise SequenceError(f"Step {index} has no outlets")
+            normalized['steps'].append({
+                'outlets': outlets,
+                'state': parse_state(step.get('state', plan.get('state', 'on'))),
+                'delay': float(step.get('delay', normalized['min_delay']))
+            })
+    except SequenceError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise SequenceError(f"Invalid plan: {e}")
+    return normalized
+
+def read_current(status):
+    """Total current in A from a PDU status, or None if it can't be read"""
+    try:
+        return float(status.get('curBan'))
+    except (TypeError, ValueError):
+        return None
+
+class SequenceRun:
+    """One execution of a plan, with its progress log"""
+
+    def __init__(self, plan):
+        self.id = uuid.uuid4().hex[:12]
+        self.plan = plan
+        self.status = 'running'
+        self.step = 0
+        self.log = []  # {'t_ms', 'message'}
+        self.results = []  # per-step outlet results
+        self.cancel_event = threading.Event()
+        self.origin = time.monotonic()
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def devices(self):
+        return {device for step in self.plan['steps'] for device, _ in step['outlets']}
+
+    @property
+    def active(self):
+        return self.status == 'running'
+
+    def note(self, message):
+        self.log.append({'t_ms': round((time.monotonic() - self.origin) * 1000, 1), 'message': message})
+        logger.info(f"Sequence {self.plan['name']} ({self.id}): {message}")
+
+    def to_dict(self):
+        return {
+            'run_id': self.id,
+            'name': self.plan['name'],
+            'status': self.status,
+            'step': self.step,
+            'steps': len(self.plan['steps']),
+            'started': self.started,
+            'finished': self.finished,
+            'log': list(self.log),
+            'results': list(self.results)
+        }
+
+class PowerSequencer:
+    """Runs power sequences in background threads, one per plan
+
+    Two sequences touching the same PDU are never allowed to run at once.
+    """
+
+    def __init__(self, controller, history=20):
+        self.controller = controller
+        self.history = history
+        self.runs = OrderedDict()  # run_id -> SequenceRun
+        self.listeners = []  # callback(run), called on every progress update
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def _notify(self, run):
+        for callback in self.listeners:
+            try:
+                callback(run)
+            except Exception as e:
+                logger.error(f"Sequence listener failed: {e}")
+
+    def start(self, plan):
+        """Validate and start a plan; returns the SequenceRun"""
+        run = SequenceRun(parse_plan(plan))
+        with self._lock:
+            for other in self.runs.values():
+                if other.active and other.devices & run.devices:
+                    raise SequenceError(f"Sequence {other.id} is already running on {sorted(other.devices & run.devices)}")
+            self.runs[run.id] = run
+            finished = [run_id for run_id, r in self.runs.items() if not r.active]
+            for run_id in finished[:max(len(self.runs) - self.history, 0)]:
+                del self.runs[run_id]
+
+        threading.Thread(target=self._run, args=(run,), name=f'sequence-{run.id}', daemon=True).start()
+        return run
+
+    def cancel(self, run_id=None):
+        """Cancel one run, or every running sequence when run_id is None"""
+        with self._lock:
+            runs = [self.runs[run_id]] if run_id in self.runs else [] if run_id else list(self.runs.values())
+        cancelled = False
+        for run in runs:
+            if run.active:
+                run.cancel_event.set()
+                cancelled = True
+        return cancelled
+
+    def get(self, run_id):
+        with self._lock:
+            return self.runs.get(run_id)
+
+    def list_runs(self):
+        with self._lock:
+            return [run.to_dict() for run in self.runs.values()]
+
+    def _wait_until(self, run, deadline):
+        """Sleep until a monotonic deadline; returns False if the run was cancelled"""
+        return not run.cancel_event.wait(max(0.0, deadline - time.monotonic()))
+
+    def _wait_for_current(self, run, devices):
+        """Poll curBan until every device is at or below the ceiling
+
+        Returns True to proceed, False if cancelled or the current never
+        settled within settle_timeout.
+        """
+        plan = run.plan
+        deadline = time.monotonic() + plan['settle_timeout']
+        next_poll = time.monotonic()
+        while True:
+            readings = {name: read_current(self.controller.read_status(name)) for name in sorted(devices)}
+            over = {name: value for name, value in readings.items()
+                    if value is None or value > plan['max_current']}
+            if not over:
+                run.note(f"Current settled: {readings}")
+                return True
+            if time.monotonic() >= deadline:
+                run.note(f"Current did not settle below {plan['max_current']} A: {over}")
+                return False
+
+            # Absolute poll times keep the interval steady regardless of request time
+            next_poll += plan['poll_interval']
+            if not self._wait_until(run, min(next_poll, deadline)):
+                return False
+
+    def _run(self, run):
+        plan = run.plan
+        steps = plan['steps']
+        status = 'completed'
+        try:
+            for index, step in enumerate(steps):
+                if run.cancel_event.is_set():
+                    status = 'cancelled'
+                    break
+
+                run.step = index + 1
+                state = 'on' if step['state'] else 'off'
+                operations = [(device, outlet, step['state']) for device, outlet in step['outlets']]
+                results = self.controller.run_bulk(operations)
+                run.results.append(results)
+                failed = [r for r in results if not r['success']]
+                run.note(f"Step {index + 1}/{len(steps)}: {len(results) - len(failed)}/{len(results)} outlets {state}")
+                self._notify(run)
+
+                if failed and plan['stop_on_error']:
+                    status = 'failed'
+                    break
+                if index == len(steps) - 1:
+                    break
+
+                if not self._wait_until(run, time.monotonic() + step['delay']):
+                    status = 'cancelled'
+                    break
+                if plan['max_current'] is not None:
+                    devices = {device for device, _ in step['outlets']} | \
+                              {device for device, _ in steps[index + 1]['outlets']}
+                    if not self._wait_for_current(run, devices):
+                        status = 'cancelled' if run.cancel_event.is_set() else 'aborted'
+                        break
+        except Exception as e:
+            run.note(f"Error: {e}")
+            status = 'failed'
+
+        run.status = status
+        run.finished = time.time()
+        run.note(f"Sequence {status}")
+        self._notify(run)
+
+# Global instance shared by the MQTT bridge and the web interface
+power_sequencer = PowerSequencer(outlet_controller)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Publish Filter
+Deadband filtering of sensor readings so jitter between polls doesn't produce new states
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def parse_deadbands(config):
+    """Turn the sensor_deadbands option into {sensor: (deadband, percent)}
+
+    Entries look like {'sensor': 'current', 'deadband': 5, 'percent': true};
+    without percent the deadband is in the sensor's own unit.
+    """
+    deadbands = {}
+    for entry in config or []:
+        try:
+            deadbands[str(entry['sensor'])] = (abs(float(entry['deadband'])), bool(entry.get('percent', False)))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Ignoring invalid sensor deadband {entry}: {e}")
+    return deadbands
+
+class DeadbandFilter:
+    """Decides whether a sensor reading is worth publishing
+
+    A reading is published when it moves more than the deadband away from
+    the last *published* value, not the last reading, so a value jittering
+    around a point stays quiet while a slow drift still gets through once
+    it adds up. Every sensor is republished at least every max_silent
+    seconds so Home Assistant can tell a steady value from a stale one.
+    """
+
+    # Readings are decimal strings; keep 1.3 - 1.2 from counting as more than 0.1
+    EPSILON = 1e-9
+
+    def __init__(self, deadbands=None, max_silent=300):
+        self.deadbands = deadbands or {}  # sensor -> (deadband, percent)
+        self.max_silent = max_silent
+        self.published = {}  # (device, sensor) -> (value, monotonic time)
+        self._lock = threading.Lock()
+
+    def _exceeds(self, sensor, previous, value):
+        deadband, percent = self.deadbands.get(sensor, (0.0, False))
+        try:
+            previous, value = float(previous), float(value)
+        except (TypeError, ValueError):
+            return previous != value
+        if percent:
+            deadband = abs(previous) * deadband / 100
+        if not deadband:
+            return previous != value
+        return abs(value - previous) > deadband + self.EPSILON
+
+    def should_publish(self, name, sensor, value, now=None):
+        """True if the reading should be published; it then becomes the reference value"""
+        now = time.monotonic() if now is None else now
+        key = (name, sensor)
+        with self._lock:
+            last = self.published.get(key)
+            if last is not None and now - last[1] < self.max_silent and not self._exceeds(sensor, last[0], value):
+                return False
+            self.published[key] = (value, now)
+            return True
+
+# Global instance; the bridge loads the deadbands from the add-on options
+deadband_filter = DeadbandFilter()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Discovery Rate Limiting
+Token buckets per subnet and for the whole scan, plus a cap on probes in flight per host
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, holding at most burst tokens"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how many seconds to wait before using it
+
+        Tokens may go negative, which queues callers in arrival order
+        without holding the lock while they sleep.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self):
+        """Give back a reserved token that was never used, moving later callers up"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+class ProbeRateLimiter:
+    """Bounds discovery load globally, per /24 subnet and per host
+
+    A rate of 0 disables that bucket. max_per_host caps how many probes to
+    the same host are in flight at once, across every scan sharing the
+    limiter; it bounds concurrency, not rate (a scan already probes each
+    host one request at a time), and 0 removes the cap.
+    """
+
+    def __init__(self, rate=0, subnet_rate=0, max_per_host=0, burst=None):
+        self.global_bucket = TokenBucket(rate, burst) if rate else None
+        self.subnet_rate = subnet_rate
+        self.burst = burst
+        self.max_per_host = max_per_host
+        self.subnet_buckets = {}
+        self.in_flight = {}
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def subnet_of(host):
+        """Return the /24 prefix of an IPv4 address (or the host itself)"""
+        parts = host.split('.')
+        return '.'.join(parts[:3]) if len(parts) == 4 else host
+
+    def _subnet_bucket(self, host):
+        subnet = self.subnet_of(host)
+        with self._condition:
+            bucket = self.subnet_buckets.get(subnet)
+            if bucket is None:
+                bucket = self.subnet_buckets[subnet] = TokenBucket(self.subnet_rate, self.burst)
+            return bucket
+
+    def _acquire_host(self, host, cancel_event):
+        with self._condition:
+            while self.max_per_host and self.in_flight.get(host, 0) >= self.max_per_host:
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                self._condition.wait(0.5)
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            return True
+
+    def _release_host(self, host):
+        with self._condition:
+            remaining = self.in_flight.get(host, 1) - 1
+            if remaining:
+                self.in_flight[host] = remaining
+            else:
+                self.in_flight.pop(host, None)
+            self._condition.notify_all()
+
+    @contextmanager
+    def probe(self, host, cancel_event=None):
+        """Context for one probe; yields False if the scan was cancelled while waiting"""
+        if not self._acquire_host(host, cancel_event):
+            yield False
+            return
+
+        try:
+            wait = 0.0
+            buckets = []
+            if self.global_bucket:
+                buckets.append(self.global_bucket)
+            if self.subnet_rate:
+                buckets.append(self._subnet_bucket(host))
+            for bucket in buckets:
+                wait = max(wait, bucket.reserve())
+
+            if wait > 0:
+                if cancel_event is not None:
+                    if cancel_event.wait(wait):
+                        # The probe never ran; don't make the next scan pay for it
+                        for bucket in buckets:
+                            bucket.refund()
+                        yield False
+                        return
+                else:
+                    time.sleep(wait)
+            yield True
+        finally:
+            self._release_host(host)
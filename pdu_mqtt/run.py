@@ -8,9 +8,18 @@ import os
 import json
 import paho.mqtt.client as mqtt
 import logging
+import signal
 import sys
 import threading
 from pdu import PDU
+from state_store import device_state_store
+from outlet_control import outlet_controller
+from power_sequencer import power_sequencer, SequenceError
+from outlet_groups import outlet_group_manager
+from energy import energy_meter
+from sensor_stats import sensor_stats, WINDOWS
+from publish_filter import deadband_filter, parse_deadbands
+from sensor_aggregates import sensor_aggregate_manager
 from typing import Dict, Any
 
 # Configure logging
@@ -25,6 +34,11 @@ logger = logging.getLogger(__name__)
 client = None
 mqtt_topic = None
 pdu_instances = {}
+outlet_topics = {}  # pdu_name -> [(set_topic, state_topic)] per outlet, built once
+outlet_counts = {}  # host -> detected outlet count, saved for the next start
+discovery_monitor = None
+
+OUTLET_COUNT_CACHE = '/data/pdu_outlets.json'
 
 def load_config():
     """Load configuration from Home Assistant add-on options"""
@@ -44,20 +58,77 @@ def load_config():
             'pdu_list': json.loads(os.getenv('PDU_LIST', '[]'))
         }
 
+def configured_pdus(config):
+    """PDU entries of the device_list option, plus the legacy pdu_list
+
+    device_list also holds Shelly devices; entries without a type are PDUs.
+    """
+    pdus = [device for device in config.get('device_list') or []
+            if str(device.get('type') or 'pdu').lower().startswith('pdu')]
+    return pdus + list(config.get('pdu_list') or [])
+
+def load_outlet_counts():
+    """Outlet counts detected on previous runs, keyed by PDU host"""
+    try:
+        with open(OUTLET_COUNT_CACHE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable outlet count cache: {e}")
+        return {}
+
+def save_outlet_counts(counts):
+    try:
+        with open(OUTLET_COUNT_CACHE, 'w') as f:
+            json.dump(counts, f)
+    except Exception as e:
+        logger.debug(f"Could not save outlet counts: {e}")
+
+def build_outlet_topics(pdu_name, count):
+    """Precompute the set/state topics of every outlet of a PDU"""
+    base = f"{mqtt_topic}/{pdu_name}"
+    return [(f"{base}/outlet{i}/set", f"{base}/outlet{i}/state") for i in range(1, count + 1)]
+
+def apply_outlet_count(pdu_name, pdu):
+    """Rebuild a PDU's outlet topics once its outlet count is detected after startup
+
+    A PDU that was unreachable at startup has no outlets yet; the first
+    successful poll detects them. The new command topics are subscribed,
+    discovery is republished and the count is remembered for the next start.
+    """
+    topics = outlet_topics[pdu_name] = build_outlet_topics(pdu_name, pdu.outlet_count)
+    logger.info(f"Detected {pdu.outlet_count} outlets on {pdu_name}")
+    outlet_counts[pdu.host] = pdu.outlet_count
+    save_outlet_counts(outlet_counts)
+    if client and client.is_connected():
+        for set_topic, _ in topics:
+            client.subscribe(set_topic)
+        send_discovery_messages()
+
 def on_connect(client, userdata, flags, rc, properties=None):
     """MQTT connection callback (compatible with both API versions)"""
     # Handle both API v1 and v2 (properties parameter is optional in v1)
     if rc == 0:
         logger.info("Connected to MQTT broker")
         
+        # Power sequencing across PDUs
+        client.subscribe(f"{mqtt_topic}/sequence/run")
+        client.subscribe(f"{mqtt_topic}/sequence/cancel")
+        
+        # Outlet groups spanning PDUs
+        for group_name in outlet_group_manager.groups:
+            client.subscribe(f"{mqtt_topic}/group/{group_name}/set")
+            logger.info(f"Subscribed to {mqtt_topic}/group/{group_name}/set")
+        
         # Subscribe to control topics for all PDUs
         for pdu_name in pdu_instances.keys():
             base = f"{mqtt_topic}/{pdu_name}"
             
             # Basic outlet control
-            for i in range(1, 9):
-                client.subscribe(f"{base}/outlet{i}/set")
-                logger.info(f"Subscribed to {base}/outlet{i}/set")
+            for set_topic, _ in outlet_topics[pdu_name]:
+                client.subscribe(set_topic)
+            logger.info(f"Subscribed to {len(outlet_topics[pdu_name])} outlet topics for {pdu_name}")
             
             # Extended configuration topics
             client.subscribe(f"{base}/config/+/set")
@@ -87,6 +158,15 @@ def on_message(client, userdata, msg):
         topic_parts = msg.topic.split('/')
         if len(topic_parts) < 3:
             return
+        
+        # Sequences span several PDUs, so handle them before the PDU lookup
+        if topic_parts[1] == 'sequence':
+            handle_sequence_message(topic_parts[2], msg.payload.decode('utf-8'))
+            return
+        if topic_parts[1] == 'group' and len(topic_parts) > 3 and topic_parts[3] == 'set':
+            group_state = msg.payload.decode('utf-8').upper() == 'ON'
+            outlet_group_manager.set(topic_parts[2], group_state)
+            return
             
         pdu_name = topic_parts[1]
         if pdu_name not in pdu_instances:
@@ -96,16 +176,11 @@ def on_message(client, userdata, msg):
         pdu = pdu_instances[pdu_name]
         payload = msg.payload.decode('utf-8')
         
-        # Basic outlet control
+        # Basic outlet control (runs on the outlet executor so the MQTT loop never waits on a PDU)
         if topic_parts[2].startswith('outlet') and len(topic_parts) > 3 and topic_parts[3] == 'set':
             outlet_num = int(topic_parts[2].replace('outlet', ''))
             state = payload.upper() == 'ON'
-            if pdu.set_outlet(outlet_num, state):
-                logger.info(f"Set {pdu_name} outlet {outlet_num} to {payload}")
-                client.publish(f"{mqtt_topic}/{pdu_name}/outlet{outlet_num}/state", 
-                             payload.upper(), retain=True)
-            else:
-                logger.error(f"Failed to set {pdu_name} outlet {outlet_num}")
+            outlet_controller.submit(pdu_name, outlet_num, state)
                 
         # Extended features (for future implementation)
         elif topic_parts[2] == 'outlet' and len(topic_parts) > 4 and topic_parts[4] == 'config' and topic_parts[5] == 'set':
@@ -130,30 +205,73 @@ def on_message(client, userdata, msg):
     except Exception as e:
         logger.error(f"Error handling message on {msg.topic}: {e}")
 
+def handle_sequence_message(action, payload):
+    """Start or cancel a power sequence from MQTT"""
+    if action == 'run':
+        try:
+            run = power_sequencer.start(json.loads(payload))
+            logger.info(f"Started power sequence {run.plan['name']} ({run.id})")
+        except (ValueError, SequenceError) as e:
+            logger.error(f"Rejected power sequence: {e}")
+            client.publish(f"{mqtt_topic}/sequence/status",
+                           json.dumps({'status': 'rejected', 'error': str(e)}), retain=False)
+    elif action == 'cancel':
+        if not power_sequencer.cancel(payload.strip() or None):
+            logger.warning(f"No running power sequence to cancel: {payload}")
+
+def publish_sequence_status(run):
+    """Publish power sequence progress"""
+    client.publish(f"{mqtt_topic}/sequence/status", json.dumps(run.to_dict()), retain=True)
+
+def publish_group_state(group):
+    """Publish an outlet group's state, recomputed from its members' changes"""
+    base = f"{mqtt_topic}/group/{group.name}"
+    client.publish(f"{base}/state", group.state, retain=True)
+    client.publish(f"{base}/attributes", json.dumps(group.attributes()), retain=True)
+
+def publish_outlet_result(result):
+    """Publish the new state of an outlet after a command, from any source"""
+    pdu_name, outlet_num = result['device'], result['outlet']
+    if result['success']:
+        logger.info(f"Set {pdu_name} outlet {outlet_num} to {result['state'].upper()} in {result['duration_ms']} ms")
+        topics = outlet_topics.get(pdu_name, [])
+        if outlet_num <= len(topics):
+            client.publish(topics[outlet_num - 1][1], result['state'].upper(), retain=True)
+    else:
+        logger.error(f"Failed to set {pdu_name} outlet {outlet_num}: {result['error']}")
+
 def publish_status(pdu_name, pdu):
     """Publish status for all outlets of a PDU"""
     try:
         logger.debug(f"Publishing status for PDU: {pdu_name}")
-        status = pdu.status()
+        with outlet_controller.device_lock(pdu_name):
+            status = pdu.status()
         if status:
+            if pdu.outlet_count and len(outlet_topics[pdu_name]) != pdu.outlet_count:
+                apply_outlet_count(pdu_name, pdu)
             # Publish outlet states
             if 'outlets' in status:
-                for i, state in enumerate(status['outlets']):
-                    outlet_num = i + 1
-                    state_topic = f"{mqtt_topic}/{pdu_name}/outlet{outlet_num}/state"
+                for (_, state_topic), state in zip(outlet_topics[pdu_name], status['outlets']):
                     mqtt_state = "ON" if state == 'on' else "OFF"
                     client.publish(state_topic, mqtt_state, retain=True)
                     logger.debug(f"Published {state_topic} = {mqtt_state}")
-            # Publish sensor data
-            if 'tempBan' in status and status['tempBan']:
-                temp_topic = f"{mqtt_topic}/{pdu_name}/sensor/temperature"
-                client.publish(temp_topic, status['tempBan'], retain=True)
-            if 'humBan' in status and status['humBan']:
-                hum_topic = f"{mqtt_topic}/{pdu_name}/sensor/humidity"
-                client.publish(hum_topic, status['humBan'], retain=True)
-            if 'curBan' in status and status['curBan']:
-                cur_topic = f"{mqtt_topic}/{pdu_name}/sensor/current"
-                client.publish(cur_topic, status['curBan'], retain=True)
+            readings = {
+                'temperature': status.get('tempBan'),
+                'humidity': status.get('humBan'),
+                'current': status.get('curBan')
+            }
+            # Publish sensor data, skipping readings that stay within their deadband
+            for sensor, value in readings.items():
+                if value and deadband_filter.should_publish(pdu_name, sensor, value):
+                    client.publish(f"{mqtt_topic}/{pdu_name}/sensor/{sensor}", value, retain=True)
+            # Energy is integrated from every sample; a missing reading breaks the series
+            energy = energy_meter.add_sample(pdu_name, status.get('curBan'))
+            client.publish(f"{mqtt_topic}/{pdu_name}/sensor/energy", f"{energy:.4f}", retain=True)
+            # Windowed statistics, published at a lower rate than the raw samples
+            sensor_stats.add(pdu_name, readings)
+            due_windows = sensor_stats.due(pdu_name)
+            if due_windows:
+                publish_sensor_stats(pdu_name, due_windows)
             # Publish device info
             device_info = {
                 "model": "LogiLink PDU8P01",
@@ -162,12 +280,36 @@ def publish_status(pdu_name, pdu):
             }
             client.publish(f"{mqtt_topic}/{pdu_name}/device/info", 
                          json.dumps(device_info), retain=True)
+            # Shared with the web interface, which serves it without polling the PDU
+            device_state_store.update(
+                pdu_name,
+                type='pdu',
+                host=pdu.host,
+                online=True,
+                outlets=status.get('outlets', []),
+                sensors=dict(readings, energy=round(energy, 4))
+            )
             logger.debug(f"Status published for PDU {pdu_name} - {len(status.get('outlets', []))} outlets")
         else:
             logger.warning(f"No status data received from PDU: {pdu_name}")
+            energy_meter.add_sample(pdu_name, None)
+            device_state_store.update(pdu_name, type='pdu', host=pdu.host, online=False)
     except Exception as e:
         logger.error(f"Error publishing status for {pdu_name}: {e}")
 
+def publish_aggregate(aggregate, summary):
+    """Publish the sums and maxima of a rack or site aggregate"""
+    client.publish(f"{mqtt_topic}/aggregate/{aggregate.name}/state", json.dumps(summary), retain=True)
+    logger.debug(f"Aggregate {aggregate.name}: {summary}")
+
+def publish_sensor_stats(pdu_name, labels=None):
+    """Publish min/max/mean/p95 per sensor and window (all, or the given labels) as JSON"""
+    for sensor, windows in sensor_stats.summaries(pdu_name, labels).items():
+        for label, summary in windows.items():
+            if summary:
+                client.publish(f"{mqtt_topic}/{pdu_name}/stats/{sensor}/{label}", json.dumps(summary), retain=True)
+    logger.debug(f"Published sensor statistics for {pdu_name}")
+
 def send_discovery_messages():
     """Send Home Assistant MQTT Discovery messages"""
     discovery_prefix = "homeassistant"
@@ -179,14 +321,14 @@ def send_discovery_messages():
         if clean_name.startswith("pdu_"):
             clean_name = clean_name[4:]
         # Create discovery for each outlet switch
-        for i in range(1, 9):
+        for i, (set_topic, state_topic) in enumerate(outlet_topics[pdu_name], start=1):
             entity_id = f"{clean_name}_outlet{i}"
             switch_config = {
                 "name": f"Outlet {i}",
                 "unique_id": entity_id,
                 "object_id": entity_id,
-                "command_topic": f"{mqtt_topic}/{pdu_name}/outlet{i}/set",
-                "state_topic": f"{mqtt_topic}/{pdu_name}/outlet{i}/state",
+                "command_topic": set_topic,
+                "state_topic": state_topic,
                 "payload_on": "ON",
                 "payload_off": "OFF",
                 "device_class": "outlet",
@@ -225,6 +367,47 @@ def send_discovery_messages():
             discovery_topic = f"{discovery_prefix}/sensor/{sensor_entity_id}/config"
             client.publish(discovery_topic, json.dumps(sensor_config), retain=True)
             logger.debug(f"Published discovery for sensor.{sensor_entity_id}")
+        # Windowed statistics: the mean as state, min/max/p95 as attributes
+        for sensor_id, name, unit, device_class in sensors:
+            for label, _ in WINDOWS:
+                stats_entity_id = f"{clean_name}_{sensor_id}_{label}"
+                stats_topic = f"{mqtt_topic}/{pdu_name}/stats/{sensor_id}/{label}"
+                stats_config = {
+                    "name": f"{name} {label} mean",
+                    "unique_id": stats_entity_id,
+                    "object_id": stats_entity_id,
+                    "state_topic": stats_topic,
+                    "value_template": "{{ value_json.mean }}",
+                    "json_attributes_topic": stats_topic,
+                    "unit_of_measurement": unit,
+                    "device_class": device_class,
+                    "state_class": "measurement",
+                    "device": {
+                        "identifiers": [f"pdu_{pdu_name}"],
+                        "name": f"PDU {pdu_name}",
+                        "model": "LogiLink PDU8P01",
+                        "manufacturer": "LogiLink"
+                    }
+                }
+                client.publish(f"{discovery_prefix}/sensor/{stats_entity_id}/config", json.dumps(stats_config), retain=True)
+        # Energy counter for the Home Assistant energy dashboard
+        energy_entity_id = f"{clean_name}_energy"
+        energy_config = {
+            "name": "Energy",
+            "unique_id": energy_entity_id,
+            "object_id": energy_entity_id,
+            "state_topic": f"{mqtt_topic}/{pdu_name}/sensor/energy",
+            "unit_of_measurement": "kWh",
+            "device_class": "energy",
+            "state_class": "total_increasing",
+            "device": {
+                "identifiers": [f"pdu_{pdu_name}"],
+                "name": f"PDU {pdu_name}",
+                "model": "LogiLink PDU8P01",
+                "manufacturer": "LogiLink"
+            }
+        }
+        client.publish(f"{discovery_prefix}/sensor/{energy_entity_id}/config", json.dumps(energy_config), retain=True)
         # Additional entities for extended features
         # Text sensor for device info
         text_sensor_config = {
@@ -240,11 +423,75 @@ def send_discovery_messages():
         }
         discovery_topic = f"{discovery_prefix}/sensor/{clean_name}_device_info/config"
         client.publish(discovery_topic, json.dumps(text_sensor_config), retain=True)
+    # Outlet groups get their own switch
+    for group_name in outlet_group_manager.groups:
+        entity_id = f"{mqtt_topic}_group_{group_name}"
+        group_config = {
+            "name": f"Group {group_name}",
+            "unique_id": entity_id,
+            "object_id": entity_id,
+            "command_topic": f"{mqtt_topic}/group/{group_name}/set",
+            "state_topic": f"{mqtt_topic}/group/{group_name}/state",
+            "json_attributes_topic": f"{mqtt_topic}/group/{group_name}/attributes",
+            "payload_on": "ON",
+            "payload_off": "OFF",
+            "device_class": "outlet",
+            "device": {
+                "identifiers": [f"{mqtt_topic}_outlet_groups"],
+                "name": "PDU Outlet Groups",
+                "model": "Outlet Group",
+                "manufacturer": "LogiLink"
+            }
+        }
+        client.publish(f"{discovery_prefix}/switch/{entity_id}/config", json.dumps(group_config), retain=True)
+        logger.debug(f"Published discovery for switch.{entity_id}")
+    # Rack and site aggregates get one sensor per sum or max
+    aggregate_sensors = [
+        ("current_total", "Total Current", "sum", "current", "A", "current", "measurement"),
+        ("current_max", "Max Current", "max", "current", "A", "current", "measurement"),
+        ("temperature_max", "Max Temperature", "max", "temperature", "°C", "temperature", "measurement"),
+        ("humidity_max", "Max Humidity", "max", "humidity", "%", "humidity", "measurement"),
+        ("energy_total", "Total Energy", "sum", "energy", "kWh", "energy", "total_increasing")
+    ]
+    for aggregate_name in sensor_aggregate_manager.aggregates:
+        state_topic = f"{mqtt_topic}/aggregate/{aggregate_name}/state"
+        for sensor_id, name, kind, sensor, unit, device_class, state_class in aggregate_sensors:
+            entity_id = f"{mqtt_topic}_aggregate_{aggregate_name}_{sensor_id}"
+            aggregate_config = {
+                "name": name,
+                "unique_id": entity_id,
+                "object_id": entity_id,
+                "state_topic": state_topic,
+                "value_template": f"{{{{ value_json['{kind}'].get('{sensor}') }}}}",
+                "json_attributes_topic": state_topic,
+                "json_attributes_template": "{{ {'members': value_json.members, 'reporting': value_json.reporting} | tojson }}",
+                "unit_of_measurement": unit,
+                "device_class": device_class,
+                "state_class": state_class,
+                "device": {
+                    "identifiers": [f"{mqtt_topic}_aggregate_{aggregate_name}"],
+                    "name": f"Aggregate {aggregate_name}",
+                    "model": "Sensor Aggregate",
+                    "manufacturer": "LogiLink"
+                }
+            }
+            client.publish(f"{discovery_prefix}/sensor/{entity_id}/config", json.dumps(aggregate_config), retain=True)
+    if discovery_monitor:
+        discovery_topic, monitor_config = discovery_monitor.discovery_config()
+        client.publish(discovery_topic, monitor_config, retain=True)
     logger.info("MQTT Discovery messages sent")
 
+def handle_sigterm(signum, frame):
+    """The Supervisor stops the add-on with SIGTERM; exit through main's cleanup"""
+    logger.info("Received SIGTERM, shutting down...")
+    sys.exit(0)
+
 def main():
     global client, mqtt_topic, pdu_instances
     
+    # Without this SIGTERM kills the process before the finally block saves state
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
     try:
         # Load configuration
         config = load_config()
@@ -253,7 +500,7 @@ def main():
         mqtt_user = config.get('mqtt_user', '')
         mqtt_password = config.get('mqtt_password', '')
         mqtt_topic = config.get('mqtt_topic', 'pdu')
-        pdu_list = config.get('pdu_list', [])
+        pdu_list = configured_pdus(config)
         
         # Start web interface in background
         logger.info("Starting PDU Discovery Web Interface...")
@@ -271,14 +518,34 @@ def main():
             return
             
         # Create PDU instances
+        outlet_counts.update(load_outlet_counts())
         for pdu_config in pdu_list:
             pdu_name = pdu_config['name']
-            pdu_instances[pdu_name] = PDU(
-                pdu_config['host'],
+            host = pdu_config['host']
+            # A configured count wins; otherwise reuse the last detection or ask the PDU once
+            pdu = pdu_instances[pdu_name] = PDU(
+                host,
                 pdu_config.get('username', 'admin'),
-                pdu_config.get('password', 'admin')
+                pdu_config.get('password', 'admin'),
+                outlet_count=pdu_config.get('outlets') or outlet_counts.get(host)
             )
-            logger.info(f"Created PDU instance for {pdu_name}")
+            count = pdu.detect_outlet_count()
+            if count and not pdu_config.get('outlets'):
+                outlet_counts[host] = count
+            # Without a count the outlets are added once the PDU first answers (apply_outlet_count)
+            outlet_topics[pdu_name] = build_outlet_topics(pdu_name, count or 0)
+            outlet_controller.register(pdu_name, pdu)
+            logger.info(f"Created PDU instance for {pdu_name} with {count or 'unknown'} outlets")
+        save_outlet_counts(outlet_counts)
+        
+        outlet_group_manager.load(config.get('outlet_groups', []))
+        # Rounded like the published energy so the first poll can't lower the sum
+        energy_totals = {name: round(total, 4) for name, total in energy_meter.totals.items()}
+        sensor_aggregate_manager.load(config.get('sensor_aggregates', []), counters={'energy': energy_totals})
+        energy_meter.voltage = float(config.get('pdu_voltage', 230))
+        sensor_stats.publish_interval = config.get('stats_interval', 300)
+        deadband_filter.deadbands = parse_deadbands(config.get('sensor_deadbands', []))
+        deadband_filter.max_silent = config.get('sensor_max_silent', 300)
         
         logger.info(f"Starting PDU MQTT Bridge v1.4.0")
         logger.info(f"MQTT: {mqtt_host}:{mqtt_port}")
@@ -298,6 +565,11 @@ def main():
         if mqtt_user:
             client.username_pw_set(mqtt_user, mqtt_password)
             
+        outlet_controller.add_listener(publish_outlet_result)
+        power_sequencer.add_listener(publish_sequence_status)
+        outlet_group_manager.add_listener(publish_group_state)
+        sensor_aggregate_manager.add_listener(publish_aggregate)
+        
         client.on_connect = on_connect
         client.on_message = on_message
         client.on_disconnect = on_disconnect
@@ -310,6 +582,9 @@ def main():
         # Wait for connection
         time.sleep(2)
         
+        # Periodic background discovery with change events
+        start_discovery_monitor(config)
+        
         # Main loop
         while True:
             try:
@@ -333,10 +608,41 @@ def main():
     except Exception as e:
         logger.error(f"Application error: {e}")
     finally:
+        energy_meter.save()
         if client:
             client.loop_stop()
             client.disconnect()
 
+def start_discovery_monitor(config):
+    """Run periodic discovery scans and publish inventory changes over MQTT"""
+    global discovery_monitor
+    
+    if not config.get('auto_discovery', False):
+        logger.info("Automatic discovery disabled")
+        return
+    
+    try:
+        from web_interface import scan_manager
+        from discovery_monitor import DiscoveryMonitor
+    except ImportError as e:
+        logger.warning(f"Discovery monitor not available: {e}")
+        return
+    
+    discovery_monitor = DiscoveryMonitor(
+        scan_manager,
+        lambda topic, payload, retain: client.publish(topic, payload, retain=retain),
+        mqtt_topic,
+        config.get('discovery_network', '192.168.1'),
+        config.get('discovery_range_start', 1),
+        config.get('discovery_range_end', 254),
+        interval=config.get('discovery_interval', 3600)
+    )
+    discovery_topic, monitor_config = discovery_monitor.discovery_config()
+    client.publish(discovery_topic, monitor_config, retain=True)
+    discovery_monitor.start()
+    logger.info(f"Background discovery every {discovery_monitor.interval}s on "
+                f"{discovery_monitor.network}.{discovery_monitor.range_start}-{discovery_monitor.range_end}")
+
 def start_web_interface():
     """Start the web interface for PDU discovery"""
     try:
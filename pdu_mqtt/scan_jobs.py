@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Scan Job Manager
+Queues network scans, runs them one at a time and lets clients follow or cancel them
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from device_detection import ScanEventStore
+
+logger = logging.getLogger(__name__)
+
+class ScanQueueFull(Exception):
+    """Raised when no more scan jobs can be queued"""
+
+class ScanJob:
+    """A single scan request with its own thread-safe result store"""
+
+    def __init__(self, network, start, end, refresh=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.network = network
+        self.start = start
+        self.end = end
+        self.refresh = refresh
+        self.status = 'queued'
+        self.results = ScanEventStore()
+        self.cancel_event = threading.Event()
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def key(self):
+        """Jobs with the same key would scan exactly the same hosts"""
+        return (self.network, self.start, self.end)
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'network': self.network,
+            'start': self.start,
+            'end': self.end,
+            'refresh': self.refresh,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+class ScanJobManager:
+    """Runs scan jobs sequentially from a bounded queue
+
+    Submitting a scan that is already queued or running returns the existing
+    job, so double clicks and extra browser tabs do not add network load.
+    """
+
+    def __init__(self, discovery, max_queued=4, history=20):
+        self.discovery = discovery
+        self.max_queued = max_queued
+        self.history = history
+        self.jobs = OrderedDict()  # job_id -> ScanJob, oldest first
+        self.queue = deque()
+        self.current = None
+        self.listeners = []  # Called with each job once it has finished running
+        self._condition = threading.Condition()
+        self._worker = None
+
+    def add_listener(self, callback):
+        """Register callback(job), called from the worker thread after each scan"""
+        self.listeners.append(callback)
+
+    def submit(self, network, start, end, refresh=False):
+        """Queue a scan, returning (job, created)"""
+        with self._condition:
+            for job in self.jobs.values():
+                if job.active and job.key == (network, start, end):
+                    return job, False
+
+            if len(self.queue) >= self.max_queued:
+                raise ScanQueueFull(f"Scan queue is full ({self.max_queued} jobs waiting)")
+
+            job = ScanJob(network, start, end, refresh)
+            self.jobs[job.id] = job
+            self.queue.append(job)
+            self._trim_history()
+            self._ensure_worker()
+            self._condition.notify()
+            logger.info(f"Queued scan job {job.id} for {network}.{start}-{end}")
+            return job, True
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it already finished"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if not job or not job.active:
+                return False
+
+            job.cancel_event.set()
+            if job.status == 'queued':
+                self.queue.remove(job)
+                self._finish(job, 'cancelled')
+            logger.info(f"Cancelled scan job {job.id}")
+            return True
+
+    def get(self, job_id=None):
+        """Return a job by id, or the most recent job"""
+        with self._condition:
+            if job_id:
+                return self.jobs.get(job_id)
+            return next(reversed(self.jobs.values()), None)
+
+    def list_jobs(self):
+        with self._condition:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def _finish(self, job, status, publish=True):
+        """Mark a job as done (caller holds the lock)"""
+        job.status = status
+        job.finished = time.time()
+        if publish:
+            job.results.finish(status)
+
+    def _trim_history(self):
+        """Drop the oldest finished jobs beyond the history limit (caller holds the lock)"""
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(len(self.jobs) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='scan-jobs', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        """Worker loop: run queued jobs one at a time"""
+        while True:
+            with self._condition:
+                while not self.queue:
+                    self._condition.wait()
+                job = self.queue.popleft()
+                job.status = 'running'
+                job.started = time.time()
+                self.current = job
+
+            try:
+                # scan_network publishes the completion event itself
+                self.discovery.scan_network(
+                    job.network, job.start, job.end,
+                    refresh=job.refresh,
+                    results=job.results,
+                    cancel_event=job.cancel_event
+                )
+                status, publish = 'cancelled' if job.cancel_event.is_set() else 'completed', False
+            except Exception as e:
+                logger.error(f"Scan job {job.id} failed: {e}")
+                status, publish = 'failed', True
+
+            with self._condition:
+                self.current = None
+                self._finish(job, status, publish)
+
+            for callback in self.listeners:
+                try:
+                    callback(job)
+                except Exception as e:
+                    logger.error(f"Scan listener failed for job {job.id}: {e}")
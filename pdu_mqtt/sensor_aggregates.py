@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Sensor Aggregates
+Rack- and site-level totals and maxima of PDU sensors, kept current from live state changes
+"""
+
+import logging
+import threading
+
+from state_store import device_state_store
+
+logger = logging.getLogger(__name__)
+
+# Counters keep their last value while a PDU is offline; a dip would read as a meter reset
+COUNTER_SENSORS = ('energy',)
+
+def parse_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class SensorAggregate:
+    """Running sum and max per sensor over the PDUs of an aggregate"""
+
+    def __init__(self, name, members):
+        self.name = name
+        self.members = members  # [pdu_name]
+        self.values = {}        # sensor -> {pdu_name: value}, online members with a reading
+        self.sums = {}          # sensor -> sum of values
+        self.maxima = {}        # sensor -> max of values
+
+    def apply(self, member, sensors):
+        """Replace one member's readings; returns True if a sum or max changed
+
+        Sums move by the member's delta. The max is only recomputed when the
+        member that held it went down, which is O(members) for that sensor only.
+        """
+        changed = False
+        for sensor in set(sensors) | {s for s, values in self.values.items() if member in values}:
+            values = self.values.setdefault(sensor, {})
+            old = values.get(member)
+            new = sensors.get(sensor)
+            if old == new or (new is None and sensor in COUNTER_SENSORS):
+                # A counter without a reading keeps its last value
+                continue
+            changed = True
+            if new is None:
+                del values[member]
+            else:
+                values[member] = new
+            self.sums[sensor] = self.sums.get(sensor, 0.0) + (new or 0.0) - (old or 0.0)
+
+            current_max = self.maxima.get(sensor)
+            if new is not None and (current_max is None or new >= current_max):
+                self.maxima[sensor] = new
+            elif old is not None and old == current_max:
+                self.maxima[sensor] = max(values.values()) if values else None
+
+            if not values:
+                # No readings left: reset instead of carrying rounding error
+                self.sums[sensor] = 0.0
+                self.maxima[sensor] = None
+        return changed
+
+    def to_dict(self):
+        return {
+            'members': len(self.members),
+            'reporting': len({member for sensor, values in self.values.items()
+                              if sensor not in COUNTER_SENSORS for member in values}),
+            'sum': {sensor: round(total, 3) for sensor, total in self.sums.items() if self.values.get(sensor)},
+            'max': {sensor: value for sensor, value in self.maxima.items() if value is not None}
+        }
+
+class SensorAggregateManager:
+    """Keeps aggregates up to date from device state changes
+
+    Each state change is looked up in a member index and only the
+    aggregates containing that PDU are adjusted, so totals follow every
+    poll without re-reading the other members.
+    """
+
+    def __init__(self, store):
+        self.aggregates = {}    # name -> SensorAggregate
+        self.member_index = {}  # pdu_name -> [SensorAggregate]
+        self.listeners = []     # callback(aggregate, summary), called when a sum or max changes
+        self._lock = threading.Lock()
+        store.add_listener(self.on_state_change)
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def load(self, config, counters=None):
+        """Create aggregates from the sensor_aggregates option: [{'name', 'pdus': [...]}]
+
+        counters ({sensor: {pdu_name: value}}, e.g. the persisted energy
+        totals) seed each member's counter, so a counter sum starts where it
+        was before a restart instead of climbing back up member by member,
+        which Home Assistant would read as a meter reset.
+        """
+        for entry in config or []:
+            try:
+                name = entry['name']
+                members = [str(member) for member in entry['pdus']]
+            except (KeyError, TypeError) as e:
+                logger.error(f"Ignoring invalid sensor aggregate {entry}: {e}")
+                continue
+            if not members:
+                logger.error(f"Ignoring sensor aggregate {name} without PDUs")
+                continue
+
+            aggregate = SensorAggregate(name, members)
+            for member in members:
+                seed = {sensor: values[member] for sensor, values in (counters or {}).items()
+                        if sensor in COUNTER_SENSORS and values.get(member) is not None}
+                aggregate.apply(member, seed)
+            with self._lock:
+                self.aggregates[name] = aggregate
+                for member in members:
+                    self.member_index.setdefault(member, []).append(aggregate)
+            logger.info(f"Loaded sensor aggregate {name} with {len(members)} PDUs")
+
+    def on_state_change(self, name, diff, state):
+        """State store listener: apply a PDU's readings to the aggregates that contain it"""
+        if 'sensors' not in diff and 'online' not in diff:
+            return
+        aggregates = self.member_index.get(name)
+        if not aggregates:
+            return
+
+        # Offline PDUs drop out of the totals until they report again
+        online = state.get('online')
+        sensors = {}
+        for sensor, value in (state.get('sensors') or {}).items():
+            value = parse_value(value)
+            if value is not None and (online or sensor in COUNTER_SENSORS):
+                sensors[sensor] = value
+
+        with self._lock:
+            updated = [(aggregate, aggregate.to_dict()) for aggregate in aggregates if aggregate.apply(name, sensors)]
+
+        for aggregate, summary in updated:
+            for callback in self.listeners:
+                try:
+                    callback(aggregate, summary)
+                except Exception as e:
+                    logger.error(f"Sensor aggregate listener failed for {aggregate.name}: {e}")
+
+# Global instance; aggregates are loaded from the add-on options by the bridge
+sensor_aggregate_manager = SensorAggregateManager(device_state_store)
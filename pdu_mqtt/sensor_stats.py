@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Sensor Statistics
+Min, max, mean and p95 of PDU sensor readings over sliding time windows
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# (label, seconds)
+WINDOWS = (('1m', 60), ('15m', 900), ('1h', 3600))
+
+class WindowStats:
+    """Aggregates of the samples within the last length seconds
+
+    Every sample is added and expired in amortized O(1): the mean comes from
+    a running sum, min and max from monotonic deques whose head is always
+    the extreme of the window, and quantiles from a histogram of values
+    rounded to the sensor resolution (the PDUs report one decimal), so it
+    stays small and exact whatever the number of samples.
+    """
+
+    def __init__(self, length, resolution=0.1):
+        self.length = length
+        self.resolution = resolution
+        self.samples = deque()  # (time, value)
+        self.total = 0.0
+        self.mins = deque()     # (time, value), increasing values
+        self.maxs = deque()     # (time, value), decreasing values
+        self.histogram = {}     # bucket -> count
+
+    def add(self, now, value):
+        self.samples.append((now, value))
+        self.total += value
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((now, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((now, value))
+        bucket = round(value / self.resolution)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        self.expire(now)
+
+    def expire(self, now):
+        cutoff = now - self.length
+        while self.samples and self.samples[0][0] <= cutoff:
+            _, value = self.samples.popleft()
+            self.total -= value
+            bucket = round(value / self.resolution)
+            self.histogram[bucket] -= 1
+            if not self.histogram[bucket]:
+                del self.histogram[bucket]
+        while self.mins and self.mins[0][0] <= cutoff:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] <= cutoff:
+            self.maxs.popleft()
+        if not self.samples:
+            self.total = 0.0  # Drop accumulated rounding error
+
+    def quantile(self, q):
+        rank = max(1, math.ceil(q * len(self.samples)))
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return round(bucket * self.resolution, 3)
+        return None
+
+    def summary(self, now):
+        """{'min', 'max', 'mean', 'p95', 'count'} or None without samples"""
+        self.expire(now)
+        count = len(self.samples)
+        if not count:
+            return None
+        return {
+            'min': self.mins[0][1],
+            'max': self.maxs[0][1],
+            'mean': round(self.total / count, 3),
+            'p95': self.quantile(0.95),
+            'count': count
+        }
+
+class SensorStats:
+    """Sliding window statistics for every sensor of every device"""
+
+    def __init__(self, windows=WINDOWS, publish_interval=300):
+        self.windows = windows
+        self.publish_interval = publish_interval
+        self.stats = {}         # (device, sensor) -> {label: WindowStats}
+        self.last_publish = {}  # (device, window label) -> monotonic time
+        self._lock = threading.Lock()
+
+    def add(self, name, readings, now=None):
+        """Add one poll's {sensor: raw value} readings; unreadable values are skipped"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for sensor, raw in readings.items():
+                try:
+                    value = float(raw)
+                except (TypeError, ValueError):
+                    continue
+                windows = self.stats.get((name, sensor))
+                if windows is None:
+                    windows = self.stats[(name, sensor)] = {
+                        label: WindowStats(length) for label, length in self.windows
+                    }
+                for window in windows.values():
+                    window.add(now, value)
+
+    def due(self, name, now=None):
+        """Labels of the windows of a device that are due for publishing
+
+        Each window is published at least once per its own length, so a 1
+        minute window never goes stale for the whole publish_interval, and at
+        most once per publish_interval. The raw samples keep their own rate.
+        """
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            for label, length in self.windows:
+                last = self.last_publish.get((name, label))
+                if last is not None and now - last < min(length, self.publish_interval):
+                    continue
+                self.last_publish[(name, label)] = now
+                due.append(label)
+        return due
+
+    def summaries(self, name, labels=None, now=None):
+        """{sensor: {window label: summary}} for a device, optionally only for some windows"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return {
+                sensor: {label: window.summary(now) for label, window in windows.items()
+                         if labels is None or label in labels}
+                for (device, sensor), windows in self.stats.items()
+                if device == name
+            }
+
+# Global instance; the bridge sets the publish interval from the add-on options
+sensor_stats = SensorStats()
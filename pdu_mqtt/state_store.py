@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Device State Store
+Thread-safe, versioned view of the latest device states shared by the poll loop and the web UI
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+def diff_state(previous, current):
+    """Return the fields of current that differ from previous
+
+    List fields (outlets) are diffed per index as {index: value} so a single
+    outlet change stays a single entry.
+    """
+    diff = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if isinstance(value, list) and isinstance(old, list) and len(old) == len(value):
+            changed = {i: v for i, (o, v) in enumerate(zip(old, value)) if o != v}
+            if changed:
+                diff[key] = changed
+        elif isinstance(value, dict) and isinstance(old, dict):
+            changed = {k: v for k, v in value.items() if old.get(k) != v}
+            if changed:
+                diff[key] = changed
+        elif old != value:
+            diff[key] = value
+    return diff
+
+class DeviceStateStore:
+    """Latest state per device with a version counter and a bounded change log
+
+    Readers never touch the devices: they get snapshots, or the diffs
+    recorded since a version they already have.
+    """
+
+    def __init__(self, history=1000):
+        self.devices = {}  # name -> state dict
+        self.version = 0
+        self.changes = deque(maxlen=history)  # (version, name, diff)
+        self.listeners = []  # callback(name, diff, state), called outside the lock
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def _merge(self, name, fields):
+        """Apply fields to a device and log the diff (caller holds the lock)"""
+        previous = self.devices.get(name, {})
+        diff = diff_state(previous, fields)
+        if not diff and name in self.devices:
+            return {}, None
+
+        state = dict(previous, **fields, name=name, updated=time.time())
+        self.devices[name] = state
+        self.version += 1
+        self.changes.append((self.version, name, diff))
+        return diff, state
+
+    def _notify(self, name, diff, state):
+        for callback in self.listeners:
+            try:
+                callback(name, diff, state)
+            except Exception as e:
+                logger.error(f"State listener failed for {name}: {e}")
+
+    def update(self, name, **fields):
+        """Merge fields into a device's state; returns the diff (empty if nothing changed)"""
+        with self._lock:
+            diff, state = self._merge(name, fields)
+        if diff:
+            self._notify(name, diff, state)
+        return diff
+
+    def set_item(self, name, key, index, value):
+        """Update one element of a list field (e.g. a single outlet) between polls"""
+        with self._lock:
+            items = list(self.devices.get(name, {}).get(key) or [])
+            if index >= len(items):
+                return {}
+            items[index] = value
+            diff, state = self._merge(name, {key: items})
+        if diff:
+            self._notify(name, diff, state)
+        return diff
+
+    def get(self, name):
+        with self._lock:
+            state = self.devices.get(name)
+            return dict(state) if state else None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'version': self.version,
+                'devices': {name: dict(state) for name, state in self.devices.items()}
+            }
+
+    def changes_since(self, version):
+        """Return (current version, merged diffs per device since version)
+
+        The diffs are None when the change log no longer reaches back to
+        version and the caller needs a fresh snapshot instead.
+        """
+        with self._lock:
+            if version == self.version:
+                return self.version, {}
+            if version > self.version or not self.changes or self.changes[0][0] > version + 1:
+                return self.version, None
+            merged = {}
+            for change_version, name, diff in self.changes:
+                if change_version <= version:
+                    continue
+                target = merged.setdefault(name, {})
+                for key, value in diff.items():
+                    if isinstance(value, dict) and isinstance(target.get(key), dict):
+                        target[key].update(value)
+                    elif isinstance(value, dict) and isinstance(target.get(key), list):
+                        merged_list = target[key] = list(target[key])
+                        for index, item in value.items():
+                            merged_list[index] = item
+                    else:
+                        target[key] = dict(value) if isinstance(value, dict) else value
+            return self.version, merged
+
+# Global instance shared by the MQTT bridge and the web interface
+device_state_store = DeviceStateStore()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Test script for the Home Assistant theme watcher - runs against a fake HA on 127.0.0.1
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from aiohttp import web
+
+class FakeHomeAssistant:
+    """Minimal HA: the WebSocket auth/subscribe/get_themes flow plus the two REST endpoints used for themes"""
+
+    def __init__(self):
+        self.theme = 'midnight'
+        self.rest_theme = 'rest_theme'
+        self.accept_websocket = True
+        self.state_requests = 0
+        self.ws = None
+        self.loop = None
+        self.port = None
+        self._runner = None
+        self._ready = threading.Event()
+
+    def themes_result(self):
+        return {'default_theme': self.theme, 'themes': {self.theme: {'primary-color': '#123456'}}}
+
+    async def websocket(self, request):
+        if not self.accept_websocket:
+            return web.Response(status=503)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({'type': 'auth_required'})
+        auth = await ws.receive_json()
+        if auth.get('access_token') != 'test-token':
+            await ws.send_json({'type': 'auth_invalid', 'message': 'bad token'})
+            await ws.close()
+            return ws
+        await ws.send_json({'type': 'auth_ok'})
+        self.ws = ws
+        async for msg in ws:
+            message = msg.json()
+            if message.get('type') == 'subscribe_events':
+                await ws.send_json({'id': message['id'], 'type': 'result', 'success': True, 'result': None})
+            elif message.get('type') == 'frontend/get_themes':
+                await ws.send_json({'id': message['id'], 'type': 'result', 'success': True,
+                                    'result': self.themes_result()})
+        self.ws = None
+        return ws
+
+    async def config(self, request):
+        return web.json_response({'version': '2024.1.0'})
+
+    async def frontend_state(self, request):
+        self.state_requests += 1
+        return web.json_response({'entity_id': 'frontend', 'attributes': {'theme': self.rest_theme}})
+
+    def start(self):
+        threading.Thread(target=self._run, name='fake-ha', daemon=True).start()
+        self._ready.wait(5)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_get('/api/websocket', self.websocket)
+        app.router.add_get('/api/config', self.config)
+        app.router.add_get('/api/states/frontend', self.frontend_state)
+        self._runner = web.AppRunner(app)
+        self.loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(5)
+
+    async def _push(self):
+        await self.ws.send_json({'id': 1, 'type': 'event', 'event': {'event_type': 'themes_updated', 'data': {}}})
+
+    def push_theme(self, theme):
+        """Change the default theme and announce it the way HA does"""
+        self.theme = theme
+        self.call(self._push())
+
+    def disconnect(self):
+        """Drop the WebSocket and refuse reconnects, as while HA restarts"""
+        self.accept_websocket = False
+        self.call(self.ws.close())
+
+    def stop(self):
+        self.call(self._runner.cleanup())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_theme_watcher_push_disconnect_and_rest_fallback():
+    """Pushed themes are used while connected; after a disconnect the REST API is asked again"""
+    server = FakeHomeAssistant()
+    server.start()
+    os.environ['HOMEASSISTANT_URL'] = f'http://127.0.0.1:{server.port}'
+    os.environ['HOMEASSISTANT_TOKEN'] = 'test-token'
+
+    from ha_theme_integration import HomeAssistantThemeIntegration
+    integration = HomeAssistantThemeIntegration(url_cache_path=os.path.join(tempfile.mkdtemp(), 'ha_url.json'))
+    watcher = integration.start_watcher()
+    try:
+        assert wait_for(lambda: watcher.connected and integration._ws_theme == 'midnight'), \
+            "initial themes not received over the WebSocket"
+        assert integration._fetch_current_theme()['theme'] == 'midnight'
+        assert server.state_requests == 0, "REST API asked while the WebSocket was connected"
+
+        server.push_theme('dawn')
+        assert wait_for(lambda: (integration.cache.peek('current_theme') or {}).get('theme') == 'dawn'), \
+            "pushed theme change not applied"
+        assert integration._fetch_current_theme()['theme'] == 'dawn'
+
+        server.disconnect()
+        assert wait_for(lambda: not watcher.connected), "watcher still connected after the server closed"
+        assert integration._fetch_current_theme()['theme'] == 'rest_theme'
+        assert server.state_requests == 1
+    finally:
+        watcher.stop()
+        server.stop()
+
+def main():
+    try:
+        test_theme_watcher_push_disconnect_and_rest_fallback()
+    except AssertionError as e:
+        print(f"✗ Theme watcher: {e}")
+        sys.exit(1)
+    print("✓ Theme watcher: push, disconnect and REST fallback")
+
+if __name__ == "__main__":
+    main()
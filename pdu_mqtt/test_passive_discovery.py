@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for passive mDNS/SSDP discovery - runs against 127.0.0.1, no real devices needed
+"""
+
+import socket
+import struct
+import sys
+import time
+
+from passive_discovery import PassiveListener, DNS_TYPE_A, DNS_TYPE_PTR, DNS_TYPE_TXT
+
+SHELLY_IP = '192.168.1.50'
+RENDERER_IP = '127.0.0.1'
+
+def free_port():
+    """Return a UDP port on 127.0.0.1 that nothing is bound to"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def encode_name(name):
+    return b''.join(bytes([len(label)]) + label.encode() for label in name.split('.')) + b'\x00'
+
+def record(name, rtype, rdata):
+    return encode_name(name) + struct.pack('!HHIH', rtype, 0x8001, 120, len(rdata)) + rdata
+
+def build_mdns_response():
+    """mDNS answer a Gen2 Shelly sends for a _shelly._tcp query: PTR, TXT and A records"""
+    instance = 'shellyplus1pm-a8032ab12345._shelly._tcp.local'
+    txt = b''.join(bytes([len(item)]) + item for item in (b'gen=2', b'app=Plus1PM'))
+    records = [
+        record('_shelly._tcp.local', DNS_TYPE_PTR, encode_name(instance)),
+        record(instance, DNS_TYPE_TXT, txt),
+        record('shellyplus1pm-a8032ab12345.local', DNS_TYPE_A, socket.inet_aton(SHELLY_IP)),
+    ]
+    # Flags 0x8400: authoritative response
+    return struct.pack('!HHHHHH', 0, 0x8400, 0, len(records), 0, 0) + b''.join(records)
+
+def build_ssdp_notify():
+    """SSDP NOTIFY of a media renderer, which can never be a PDU"""
+    return ('NOTIFY * HTTP/1.1\r\n'
+            'HOST: 239.255.255.250:1900\r\n'
+            'CACHE-CONTROL: max-age=1800\r\n'
+            'LOCATION: http://127.0.0.1:49152/description.xml\r\n'
+            'NT: urn:schemas-upnp-org:device:MediaRenderer:1\r\n'
+            'NTS: ssdp:alive\r\n'
+            'SERVER: Linux/4.9 UPnP/1.0 TV/1.0\r\n'
+            'USN: uuid:4d696e69-444c-164e-9d41-b827eb123456::urn:schemas-upnp-org:device:MediaRenderer:1\r\n'
+            '\r\n').encode()
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_passive_listener_loopback():
+    """Announcements sent over loopback end up in the inventory and steer partition()"""
+    mdns_addr = ('127.0.0.1', free_port())
+    ssdp_addr = ('127.0.0.1', free_port())
+    listener = PassiveListener(mdns_addr=mdns_addr, ssdp_addr=ssdp_addr, query_interval=0)
+    listener.start()
+    try:
+        assert len(listener.sockets) == 2, "listener sockets did not open"
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(build_mdns_response(), mdns_addr)
+            sender.sendto(build_ssdp_notify(), ssdp_addr)
+
+        assert wait_for(lambda: len(listener.get_inventory()) == 2), \
+            f"inventory incomplete: {listener.get_inventory()}"
+
+        inventory = {entry['ip']: entry for entry in listener.get_inventory()}
+        shelly = inventory[SHELLY_IP]
+        assert shelly['kind'] == 'shelly'
+        assert shelly['source'] == 'mdns'
+        assert shelly['model'] == 'Plus1PM'
+        assert shelly['generation'] == 2
+        renderer = inventory[RENDERER_IP]
+        assert renderer['kind'] == 'false_positive'
+        assert renderer['source'] == 'ssdp'
+        assert renderer['location'] == 'http://127.0.0.1:49152/description.xml'
+
+        devices, ignored, remaining = listener.partition([SHELLY_IP, RENDERER_IP, '192.168.1.60'])
+        assert [device['ip'] for device in devices] == [SHELLY_IP]
+        assert devices[0]['type'] == 'Shelly Gen2'
+        assert devices[0]['source'] == 'mdns'
+        assert ignored == [RENDERER_IP]
+        assert remaining == ['192.168.1.60']
+    finally:
+        listener.stop()
+
+def main():
+    try:
+        test_passive_listener_loopback()
+    except AssertionError as e:
+        print(f"✗ Passive discovery: {e}")
+        sys.exit(1)
+    print("✓ Passive discovery: mDNS and SSDP announcements recorded and partitioned")
+
+if __name__ == "__main__":
+    main()
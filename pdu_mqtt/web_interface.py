@@ -4,8 +4,12 @@ Web Interface for Device Discovery and Configuration
 Modern visual interface for discovering PDUs, Shelly devices, and other network devices
 """
 
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, Response, render_template, jsonify, request, send_from_directory, stream_with_context
+import functools
+import hashlib
+import hmac
 import json
+import math
 import os
 import threading
 import time
@@ -14,8 +18,15 @@ import requests
 from xml.etree import ElementTree as ET
 import logging
 import re
-from device_detection import DeviceDiscovery
+from device_detection import DeviceDiscovery, DEFAULT_PROBE_MAX_BYTES
+from discovery_cache import DiscoveryCache
+from scan_jobs import ScanJobManager, ScanQueueFull
+from rate_limiter import ProbeRateLimiter
+from passive_discovery import PassiveListener
 from ha_theme_integration import ha_theme_integration
+from state_store import device_state_store
+from outlet_control import outlet_controller, parse_state
+from power_sequencer import power_sequencer, SequenceError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -36,6 +47,16 @@ def load_translations():
 
 TRANSLATIONS = load_translations()
 
+def load_addon_options():
+    """Load Home Assistant add-on options used by the web interface"""
+    try:
+        with open('/data/options.json', 'r') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+ADDON_OPTIONS = load_addon_options()
+
 def detect_language(request):
     """Detect user's preferred language from Accept-Language header"""
     accept_language = request.headers.get('Accept-Language', '')
@@ -189,50 +210,211 @@ class PDUController:
             }
 
 # Global instances
-device_discovery = DeviceDiscovery()
+device_discovery = DeviceDiscovery(
+    max_probe_bytes=ADDON_OPTIONS.get('discovery_probe_max_bytes', DEFAULT_PROBE_MAX_BYTES),
+    cache=DiscoveryCache(
+        device_ttl=ADDON_OPTIONS.get('discovery_cache_ttl', 3600),
+        empty_ttl=ADDON_OPTIONS.get('discovery_empty_ttl', 900)
+    ),
+    use_neighbours=ADDON_OPTIONS.get('discovery_use_neighbours', True),
+    rate_limiter=ProbeRateLimiter(
+        rate=ADDON_OPTIONS.get('discovery_rate_limit', 0),
+        subnet_rate=ADDON_OPTIONS.get('discovery_subnet_rate_limit', 0),
+        max_per_host=ADDON_OPTIONS.get('discovery_max_probes_per_host', 2)
+    )
+)
+if ADDON_OPTIONS.get('discovery_passive', True):
+    device_discovery.passive = PassiveListener(detector=device_discovery.detector)
+scan_manager = ScanJobManager(device_discovery)
 shelly_controller = ShellyController()
 pdu_controller = PDUController()
 
+def conditional_response(body, mimetype='application/json', etag=None):
+    """Response with a content-hash ETag; answers a matching If-None-Match with 304"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    response = app.response_class(response=body, mimetype=mimetype)
+    response.set_etag(etag or hashlib.sha1(body).hexdigest())
+    # Clients may keep the body but must revalidate before using it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/')
 def index():
     """Main interface page"""
     lang = detect_language(request)
     translations = get_translations(lang)
     theme_info = ha_theme_integration.get_theme_info()
-    return render_template('index.html', lang=lang, t=translations, theme_info=theme_info)
+    _, theme_etag = ha_theme_integration.get_theme_info_json()
+    return render_template('index.html', lang=lang, t=translations, theme_info=theme_info,
+                           theme_etag=f'"{theme_etag}"')
 
 @app.route('/api/scan', methods=['POST'])
 def start_scan():
-    """Start device discovery scan"""
+    """Queue a device discovery scan, or join an identical one already queued"""
     try:
         data = request.get_json()
         network = data.get('network', '192.168.1')
         start_ip = int(data.get('start', 1))
         end_ip = int(data.get('end', 254))
+        refresh = bool(data.get('refresh', False))
         
-        # Start scan in background thread
-        thread = threading.Thread(
-            target=device_discovery.scan_network,
-            args=(network, start_ip, end_ip)
-        )
-        thread.daemon = True
-        thread.start()
+        job, created = scan_manager.submit(network, start_ip, end_ip, refresh)
         
-        return jsonify({'status': 'started', 'message': 'Scan started'})
+        return jsonify({
+            'status': 'queued' if created else 'joined',
+            'message': 'Scan started' if created else 'Scan already in progress',
+            'job_id': job.id,
+            'job': job.to_dict()
+        })
+    except ScanQueueFull as e:
+        return jsonify({'error': str(e)}), 429
     except Exception as e:
         logger.error(f"Error starting scan: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/scan/status', methods=['GET'])
 def get_scan_status():
-    """Get current scan status"""
+    """Get status of a scan job (the latest one by default)"""
     try:
-        status = device_discovery.get_scan_status()
+        job = scan_manager.get(request.args.get('job'))
+        if not job:
+            return jsonify({'scanning': False, 'progress': 0, 'discovered_devices': []})
+        
+        status = job.results.snapshot()
+        status['job'] = job.to_dict()
         return jsonify(status)
     except Exception as e:
         logger.error(f"Error getting scan status: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/scan/jobs', methods=['GET'])
+def list_scan_jobs():
+    """List queued, running and recent scan jobs"""
+    return jsonify({'jobs': scan_manager.list_jobs()})
+
+@app.route('/api/scan/<job_id>/cancel', methods=['POST'])
+def cancel_scan(job_id):
+    """Cancel a queued or running scan job"""
+    if scan_manager.cancel(job_id):
+        return jsonify({'success': True, 'message': 'Scan cancelled'})
+    return jsonify({'success': False, 'error': 'Scan job not found or already finished'}), 404
+
+# Every open event stream holds a waitress worker for as long as it is open.
+# At most half the workers may do so; further streams get a 503 and the page
+# polls instead, so plain requests always find a free worker.
+stream_slots = threading.BoundedSemaphore(max(1, ADDON_OPTIONS.get('web_threads', 32) // 2))
+
+# Live update streams end after this many seconds and the page reconnects,
+# which hands slots to pages that were refused while all of them were taken
+LIVE_STREAM_MAX_AGE = 600
+
+def event_stream(generator):
+    """Serve an SSE generator if a stream slot is free, else answer 503"""
+    if not stream_slots.acquire(blocking=False):
+        generator.close()
+        return jsonify({'error': 'Too many open event streams'}), 503, {'Retry-After': '60'}
+    response = Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Called by the server when the stream ends or the client goes away
+    response.call_on_close(stream_slots.release)
+    return response
+
+@app.route('/api/scan/events', methods=['GET'])
+def scan_events():
+    """Stream progress and discovered devices of a scan job as Server-Sent Events"""
+    job = scan_manager.get(request.args.get('job'))
+    if not job:
+        return jsonify({'error': 'Scan job not found'}), 404
+    
+    # EventSource sends Last-Event-ID when it reconnects; a garbled one
+    # falls back to the page's last_id parameter, then to a full replay
+    try:
+        last_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_id = request.args.get('last_id', 0, type=int)
+    
+    def generate(last_id):
+        while True:
+            events = job.results.wait_for_events(last_id)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                last_id = event['id']
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                if event['event'] == 'complete':
+                    return
+    
+    return event_stream(generate(last_id))
+
+# Wakes every open /api/events stream when the theme or any device state changes
+live_changes = threading.Condition()
+live_generation = 0
+
+def notify_live(*args):
+    global live_generation
+    with live_changes:
+        live_generation += 1
+        live_changes.notify_all()
+
+ha_theme_integration.add_listener(notify_live)
+device_state_store.add_listener(notify_live)
+
+@app.route('/api/devices/state', methods=['GET'])
+def get_device_states():
+    """Latest polled device states, served from memory without touching the devices"""
+    snapshot = device_state_store.snapshot()
+    return conditional_response(json.dumps(snapshot), etag=f"state-{snapshot['version']}")
+
+@app.route('/api/events', methods=['GET'])
+def live_events():
+    """Push theme changes and device state diffs to the page as Server-Sent Events"""
+    # The page passes the theme ETag and state version it already has, so
+    # changes made while it was connecting (or reconnecting) are still delivered
+    sent_etag = request.args.get('theme_etag', '').strip('"')
+    state_version = request.args.get('state_version', type=int)
+    
+    def generate(sent_etag, state_version):
+        yield "retry: 5000\n\n"
+        generation = None
+        deadline = time.monotonic() + LIVE_STREAM_MAX_AGE
+        while time.monotonic() < deadline:
+            with live_changes:
+                if generation is not None and live_changes.wait_for(lambda: live_generation != generation, 15) is False:
+                    yield ": keep-alive\n\n"
+                    continue
+                generation = live_generation
+            
+            body, etag = ha_theme_integration.get_theme_info_json()
+            if etag != sent_etag:
+                sent_etag = etag
+                yield f"event: theme\ndata: {body}\n\n"
+            
+            changes = None
+            if state_version is not None:
+                current_version, changes = device_state_store.changes_since(state_version)
+            if changes is None:
+                # No usable base version: send the full state once
+                snapshot = device_state_store.snapshot()
+                state_version = snapshot['version']
+                yield f"event: state_snapshot\ndata: {json.dumps(snapshot)}\n\n"
+            elif changes:
+                state_version = current_version
+                yield f"event: state\ndata: {json.dumps({'version': state_version, 'devices': changes})}\n\n"
+    
+    return event_stream(generate(sent_etag, state_version))
+
+@app.route('/api/discovery/passive', methods=['GET'])
+def get_passive_inventory():
+    """List devices seen through mDNS/SSDP announcements"""
+    if not device_discovery.passive:
+        return jsonify({'enabled': False, 'devices': []})
+    return jsonify({'enabled': True, 'devices': device_discovery.passive.get_inventory()})
+
 @app.route('/api/test_credentials', methods=['POST'])
 def test_credentials():
     """Test device credentials"""
@@ -269,6 +451,86 @@ def toggle_shelly():
         logger.error(f"Error toggling Shelly: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def require_control_token(view):
+    """Only serve view to requests carrying the web_control_token as a bearer token
+
+    Port 8099 is reachable from the whole LAN, so endpoints that switch many
+    outlets at once or run power sequences stay disabled until a token is
+    configured.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = ADDON_OPTIONS.get('web_control_token') or ''
+        if not token:
+            return jsonify({'success': False, 'error': 'Set web_control_token to enable this endpoint'}), 403
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {token}".encode('utf-8')):
+            return jsonify({'success': False, 'error': 'Invalid or missing control token'}), 401, \
+                {'WWW-Authenticate': 'Bearer'}
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/outlets/bulk', methods=['POST'])
+@require_control_token
+def bulk_outlet_control():
+    """Switch many PDU outlets at once: parallel across PDUs, in order within each PDU"""
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'error': 'operations must be a non-empty list'}), 400
+    
+    parsed = []
+    for index, operation in enumerate(operations):
+        try:
+            parsed.append((str(operation['device']), int(operation['outlet']), parse_state(operation['state'])))
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': f"Invalid operation {index}: {e}"}), 400
+    
+    # Checked before anything is queued: a bad timeout must not leave outlets switching
+    timeout = data.get('timeout', 60)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or \
+            not math.isfinite(timeout) or timeout <= 0:
+        return jsonify({'success': False, 'error': 'timeout must be a positive number of seconds'}), 400
+    
+    started = time.monotonic()
+    results = outlet_controller.run_bulk(parsed, timeout=timeout)
+    return jsonify({
+        'success': all(result['success'] for result in results),
+        'results': results,
+        'duration_ms': round((time.monotonic() - started) * 1000, 1)
+    })
+
+@app.route('/api/sequences', methods=['GET'])
+def list_sequences():
+    """Recent power sequences"""
+    return jsonify({'sequences': power_sequencer.list_runs()})
+
+@app.route('/api/sequences', methods=['POST'])
+@require_control_token
+def start_sequence():
+    """Start a power sequence"""
+    try:
+        run = power_sequencer.start(request.get_json(silent=True))
+    except SequenceError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'sequence': run.to_dict()}), 202
+
+@app.route('/api/sequences/<run_id>', methods=['GET'])
+def get_sequence(run_id):
+    """Progress of a power sequence"""
+    run = power_sequencer.get(run_id)
+    if not run:
+        return jsonify({'error': 'Sequence not found'}), 404
+    return jsonify(run.to_dict())
+
+@app.route('/api/sequences/<run_id>/cancel', methods=['POST'])
+@require_control_token
+def cancel_sequence(run_id):
+    """Stop a power sequence before its next step"""
+    if power_sequencer.cancel(run_id):
+        return jsonify({'success': True, 'message': 'Sequence cancelled'})
+    return jsonify({'success': False, 'error': 'Sequence not found or already finished'}), 404
+
 @app.route('/api/shelly/status', methods=['GET'])
 def get_shelly_status():
     """Get Shelly device status"""
@@ -316,9 +578,10 @@ def load_config():
     try:
         config_path = os.path.join(os.path.dirname(__file__), 'device_config.json')
         if os.path.exists(config_path):
-            with open(config_path, 'r') as f:
-                config = json.load(f)
-            return jsonify(config)
+            with open(config_path, 'rb') as f:
+                data = f.read()
+            json.loads(data)  # Only serve a valid config
+            return conditional_response(data)
         else:
             return jsonify({'device_list': []})
     except Exception as e:
@@ -329,8 +592,8 @@ def load_config():
 def get_ha_theme():
     """Get Home Assistant theme information"""
     try:
-        theme_info = ha_theme_integration.get_theme_info()
-        return jsonify(theme_info)
+        body, etag = ha_theme_integration.get_theme_info_json()
+        return conditional_response(body, etag=etag)
     except Exception as e:
         logger.error(f"Error getting HA theme: {e}")
         return jsonify({'error': str(e)}), 500
@@ -340,16 +603,8 @@ def get_ha_theme_css():
     """Get Home Assistant theme CSS"""
     try:
         theme_name = request.args.get('theme')
-        css = ha_theme_integration.generate_css_variables(theme_name)
-        
-        response = app.response_class(
-            response=css,
-            mimetype='text/css'
-        )
-        
-        # Add caching headers
-        response.headers['Cache-Control'] = 'public, max-age=300'  # 5 minutes
-        return response
+        css, etag = ha_theme_integration.get_theme_css(theme_name)
+        return conditional_response(css, mimetype='text/css', etag=etag)
     except Exception as e:
         logger.error(f"Error generating theme CSS: {e}")
         return app.response_class(
@@ -361,8 +616,7 @@ def get_ha_theme_css():
 def refresh_ha_theme():
     """Refresh Home Assistant theme cache"""
     try:
-        ha_theme_integration.cached_theme = None
-        theme_info = ha_theme_integration.get_theme_info()
+        theme_info = ha_theme_integration.refresh()
         return jsonify(theme_info)
     except Exception as e:
         logger.error(f"Error refreshing HA theme: {e}")
@@ -372,7 +626,36 @@ def run_server(host='0.0.0.0', port=8099):
     """Run the web interface server"""
     try:
         logger.info(f"Starting Device Discovery Web Interface on {host}:{port}")
-        app.run(host=host, port=port, debug=False, threaded=True)
+        if device_discovery.passive:
+            device_discovery.passive.start()
+        # Start fetching the HA theme so the first page render already has it
+        ha_theme_integration.get_theme_info()
+        ha_theme_integration.start_watcher()
+
+        try:
+            from waitress import serve
+        except ImportError:
+            serve = None
+
+        if serve is None or ADDON_OPTIONS.get('web_server', 'waitress') != 'waitress':
+            logger.warning("Using the Flask development server")
+            app.run(host=host, port=port, debug=False, threaded=True)
+            return
+
+        # Event streams may take at most half of these threads (see stream_slots)
+        threads = ADDON_OPTIONS.get('web_threads', 32)
+        # Short queues under bursts are expected; don't log a warning per request
+        logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+        logger.info(f"Serving with waitress ({threads} threads)")
+        serve(
+            app,
+            host=host,
+            port=port,
+            threads=threads,
+            connection_limit=ADDON_OPTIONS.get('web_connection_limit', 100),
+            channel_timeout=ADDON_OPTIONS.get('web_channel_timeout', 120),
+            ident=None
+        )
     except Exception as e:
         logger.error(f"Error starting web server: {e}")
 